@@ -0,0 +1,97 @@
+"""Микробенчмарк фильтра постов: QueryMatcher против отдельного re.search на каждый запрос.
+
+Запуск из корня репозитория:
+    python benchmarks/matcher_benchmark.py --posts 20000 --queries 30
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vk_scraper import QueryMatcher
+
+WORDS = (
+    "новости город власти жители сегодня вчера завтра проект строительство дорога школа больница "
+    "президент правительство министр закон бюджет экономика рынок цены рубль доллар нефть газ "
+    "технологии интернет компания стартап данные сеть сервис приложение телефон робот модель "
+    "искусственный интеллект нейросеть обучение университет студенты наука исследование учёные "
+    "погода снег дождь мороз лето зима весна осень праздник концерт выставка театр кино фильм "
+    "футбол хоккей матч команда победа тренер сезон чемпионат спорт здоровье врачи лечение "
+    "транспорт метро автобус поезд самолёт аэропорт туризм отдых море горы парк музей библиотека"
+).split()
+
+QUERY_SEEDS = (
+    "искусственный интеллект", "нейросеть", "экономика", "цены", "метро", "хоккей", "выставка",
+    "строительство дорога", "учёные", "интернет", "бюджет", "погода", "концерт", "робот", "школа",
+)
+
+def make_queries(count, rng):
+    queries = list(QUERY_SEEDS[:count])
+    while len(queries) < count:
+        queries.append(" ".join(rng.sample(WORDS, rng.choice((1, 2)))))
+    return list(dict.fromkeys(queries))
+
+def make_corpus(posts, rng):
+    corpus = []
+    for _ in range(posts):
+        words = rng.choices(WORDS, k=rng.randint(20, 120))
+        text = " ".join(words)
+        corpus.append(text.capitalize() + ".")
+    return corpus
+
+def match_per_item(corpus, queries):
+    # Прежний фильтр execute_query: отдельное регулярное выражение на каждый запрос и пост
+    results = []
+    for text in corpus:
+        matched = set()
+        for query in queries:
+            if re.search(r'\b' + re.escape(query) + r'\b', text, re.IGNORECASE):
+                matched.add(query)
+        results.append(matched)
+    return results
+
+def match_compiled(corpus, queries):
+    matcher = QueryMatcher(queries, 'exact')
+    return [set(matcher.match(text)) for text in corpus]
+
+def measure(function, *args, repeat=3):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    queries = make_queries(args.queries, rng)
+    # Сравниваем без «ё»: QueryMatcher, в отличие от старого фильтра, приравнивает её к «е»
+    queries = [query for query in queries if 'ё' not in query]
+    corpus = make_corpus(args.posts, rng)
+
+    baseline_time, baseline = measure(match_per_item, corpus, queries)
+    compiled_time, compiled = measure(match_compiled, corpus, queries)
+
+    if baseline != compiled:
+        mismatches = sum(1 for old, new in zip(baseline, compiled) if old != new)
+        raise SystemExit(f"Результаты расходятся в {mismatches} постах")
+
+    matched_posts = sum(1 for matched in compiled if matched)
+    print(f"Постов: {len(corpus)}, запросов: {len(queries)}, постов с совпадениями: {matched_posts}")
+    print(f"re.search на каждый запрос: {baseline_time:.3f} сек")
+    print(f"QueryMatcher:               {compiled_time:.3f} сек")
+    print(f"Ускорение:                  x{baseline_time / compiled_time:.1f}")
+
+if __name__ == "__main__":
+    main()
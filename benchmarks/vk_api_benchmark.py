@@ -0,0 +1,451 @@
+"""Сквозной бенчмарк парсера на локальном имитаторе VK API.
+
+Имитатор работает в отдельном процессе и отвечает на newsfeed.search, wall.getComments,
+wall.getById, users.get и execute. Задержка ответа, лимит запросов на токен, доля случайных
+ошибок 6 и плотность синтетического корпуса русских постов настраиваются. Бенчмарк прогоняет
+get_vk_newsfeed целиком и сохраняет метрики в JSON, чтобы сравнивать запуски между изменениями.
+
+Запуск из корня репозитория:
+    python benchmarks/vk_api_benchmark.py --hours 48 --queries 5 --comments --engine async
+    python benchmarks/vk_api_benchmark.py --comments --compare benchmarks/results/vk_api_20240101_120000.json
+"""
+import argparse
+import collections
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vk_scraper
+from matcher_benchmark import WORDS, make_queries
+from vk_scraper import ApiMetrics, get_vk_newsfeed, validate_tokens
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+BENCHMARK_START = datetime.datetime(2024, 1, 1)
+
+# VK отдаёт по поиску не больше 1000 постов на запрос
+SEARCH_LIMIT = 1000
+
+class FakeVK:
+    """Состояние имитатора: детерминированный корпус, лимиты токенов и счётчики запросов."""
+
+    def __init__(self, config):
+        self.config = config
+        self.queries = config['queries']
+        self.lock = threading.Lock()
+        self.rng = random.Random(config['seed'])
+        self.token_calls = collections.defaultdict(collections.deque)
+        self.answered_calls = set()
+        self.hours = {}
+        self.stats = {
+            'http_requests': 0,
+            'calls_by_method': collections.Counter(),
+            'rate_limited': 0,
+            'injected_errors': 0,
+            'duplicate_calls': 0,
+            'failed_calls': 0,
+        }
+
+    def hour_posts(self, hour):
+        # Посты одного часа всегда одинаковы, поэтому повторный запрос окна отдаёт тот же ответ;
+        # готовые часы запоминаются, чтобы имитатор не тратил время ответа на генерацию текста
+        if hour not in self.hours:
+            self.hours[hour] = self.generate_hour(hour)
+        return self.hours[hour]
+
+    def generate_hour(self, hour):
+        rng = random.Random(f"{self.config['seed']}:{hour}")
+        posts = []
+        for index in range(self.config['posts_per_hour']):
+            words = rng.choices(WORDS, k=rng.randint(15, 60))
+            if rng.random() < self.config['match_rate']:
+                position = rng.randrange(len(words) + 1)
+                words[position:position] = rng.choice(self.queries).split()
+            post_id = hour * 1000 + index
+            posts.append({
+                'id': post_id,
+                'owner_id': -(1 + index % 50),
+                'from_id': -(1 + index % 50),
+                'date': hour * 3600 + rng.randrange(3600),
+                'text': " ".join(words).capitalize() + ".",
+                'post_type': 'post',
+                'likes': {'count': rng.randrange(500)},
+                'reposts': {'count': rng.randrange(50)},
+                'views': {'count': rng.randrange(10000)},
+                'comments': {'count': self.comment_count(post_id)},
+            })
+        # Вместе с постом хранится множество его слов для имитации поиска
+        return [(post, set(post['text'].lower().rstrip('.').split())) for post in posts]
+
+    def comment_count(self, post_id):
+        rng = random.Random(f"{self.config['seed']}:comments:{post_id}")
+        return int(rng.expovariate(1 / self.config['comments_per_post'])) if self.config['comments_per_post'] else 0
+
+    def newsfeed_search(self, params):
+        start_time, end_time = int(params['start_time']), int(params['end_time'])
+        # Как и VK, поиск отдаёт посты хотя бы с одним словом запроса; точную фразу проверяет парсер
+        query_words = set(params['q'].lower().split())
+        posts = [
+            post
+            for hour in range(start_time // 3600, (end_time - 1) // 3600 + 1)
+            for post, words in self.hour_posts(hour)
+            if start_time <= post['date'] < end_time and query_words & words
+        ]
+        posts.sort(key=lambda post: post['date'], reverse=True)
+        posts = posts[:SEARCH_LIMIT]
+
+        offset = int(params.get('start_from') or 0)
+        count = int(params.get('count', 30))
+        response = {'items': posts[offset:offset + count], 'count': len(posts), 'total_count': len(posts)}
+        if offset + count < len(posts):
+            response['next_from'] = str(offset + count)
+        return response
+
+    def wall_get_comments(self, params):
+        post_id = int(params['post_id'])
+        # Ответов в ветках имитатор не создаёт: запрос ветки возвращает пустой список
+        total = 0 if 'comment_id' in params else self.comment_count(post_id)
+        comment_ids = [post_id * 1000 + index for index in range(total)]
+        if params.get('sort') == 'desc':
+            comment_ids.reverse()
+        offset = int(params.get('offset', 0))
+        count = int(params.get('count', 10))
+        items = [
+            {
+                'id': comment_id,
+                'from_id': 1 + comment_id % 997,
+                'date': int(BENCHMARK_START.timestamp()) + comment_id % 86400,
+                'text': " ".join(random.Random(comment_id).choices(WORDS, k=8)),
+                'post_id': post_id,
+                'owner_id': int(params['owner_id']),
+                'parents_stack': [],
+                'likes': {'count': comment_id % 7},
+                'thread': {'count': 0, 'items': []},
+            }
+            for comment_id in comment_ids[offset:offset + count]
+        ]
+        return {'items': items, 'count': total, 'current_level_count': total}
+
+    def wall_get_by_id(self, params):
+        # Текущее число комментариев берётся из comment_count, чтобы его можно было менять между запусками
+        posts = []
+        for key in params['posts'].split(','):
+            post_id = int(key.split('_')[1])
+            post, _ = self.hour_posts(post_id // 1000)[post_id % 1000]
+            posts.append({**post, 'comments': {'count': self.comment_count(post_id)}})
+        return posts
+
+    def users_get(self, params):
+        return [{'id': 1, 'first_name': 'Тест', 'last_name': 'Тестов'}]
+
+    def call(self, method, params):
+        handlers = {
+            'newsfeed.search': self.newsfeed_search,
+            'wall.getComments': self.wall_get_comments,
+            'wall.getById': self.wall_get_by_id,
+            'users.get': self.users_get,
+        }
+        with self.lock:
+            self.stats['calls_by_method'][method] += 1
+        if method not in handlers:
+            with self.lock:
+                self.stats['failed_calls'] += 1
+            return None
+
+        key = json.dumps([method, params], sort_keys=True, ensure_ascii=False)
+        with self.lock:
+            if key in self.answered_calls:
+                self.stats['duplicate_calls'] += 1
+            self.answered_calls.add(key)
+        return handlers[method](params)
+
+    def execute(self, code):
+        # Код пакета имеет вид return [API.method({...}),API.method({...})];
+        decoder = json.JSONDecoder()
+        responses, errors = [], []
+        position = code.find("API.")
+        while position != -1:
+            params_start = code.index("(", position)
+            method = code[position + 4:params_start]
+            params, params_end = decoder.raw_decode(code, params_start + 1)
+            response = self.call(method, {key: str(value) for key, value in params.items()})
+            if response is None:
+                responses.append(False)
+                errors.append({'method': method, 'error_code': 3, 'error_msg': 'Unknown method passed'})
+            else:
+                responses.append(response)
+            position = code.find("API.", params_end)
+        time.sleep(self.config['call_latency'] * len(responses))
+        result = {'response': responses}
+        if errors:
+            result['execute_errors'] = errors
+        return result
+
+    def handle(self, method, params):
+        # Лимит считается по моменту прихода запроса, задержка ответа добавляется после
+        now = time.monotonic()
+        token = params.pop('access_token', '')
+        params.pop('v', None)
+        with self.lock:
+            self.stats['http_requests'] += 1
+            latency = max(self.rng.gauss(self.config['latency'], self.config['jitter']), 0)
+            inject_error = self.rng.random() < self.config['error_rate']
+            calls = self.token_calls[token]
+            while calls and now - calls[0] >= 1.0:
+                calls.popleft()
+            rate_limited = len(calls) >= self.config['rate_limit']
+            calls.append(now)
+            if rate_limited:
+                self.stats['rate_limited'] += 1
+            elif inject_error:
+                self.stats['injected_errors'] += 1
+        time.sleep(latency)
+        if rate_limited or inject_error:
+            return {'error': {'error_code': 6, 'error_msg': 'Too many requests per second'}}
+
+        if method == 'execute':
+            return self.execute(params['code'])
+        response = self.call(method, params)
+        if response is None:
+            return {'error': {'error_code': 3, 'error_msg': 'Unknown method passed'}}
+        return {'response': response}
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, 'calls_by_method': dict(self.stats['calls_by_method'])}
+
+class FakeVKHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.respond(urllib.parse.urlsplit(self.path).query)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.respond(body.decode('utf-8'))
+
+    def respond(self, query):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/stats':
+            result = self.server.fake.snapshot()
+        else:
+            params = dict(urllib.parse.parse_qsl(query))
+            result = self.server.fake.handle(path.rsplit('/', 1)[-1], params)
+        body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class FakeVKServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+def serve(config, port_queue):
+    server = FakeVKServer(('127.0.0.1', 0), FakeVKHandler)
+    server.fake = FakeVK(config)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+def fetch_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        return json.load(response)
+
+def instrument_http(latencies):
+    """Замеряет время каждого HTTP-запроса обоих движков парсера."""
+    session_post = vk_scraper.http_session.post
+
+    def timed_post(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return session_post(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    vk_scraper.http_session.post = timed_post
+
+    session_request = aiohttp.ClientSession._request
+
+    async def timed_request(session, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await session_request(session, *args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    aiohttp.ClientSession._request = timed_request
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(round(fraction * (len(values) - 1))), len(values) - 1)]
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(args, queries, base_url):
+    vk_scraper.VK_API_URL = f"{base_url}/method"
+    vk_scraper.http_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=100))
+    latencies = []
+    instrument_http(latencies)
+
+    tokens = [f"benchmark-token-{index}" for index in range(args.tokens)]
+    valid_tokens, _ = validate_tokens(tokens)
+    if len(valid_tokens) != len(tokens):
+        raise SystemExit(f"Имитатор принял {len(valid_tokens)} токенов из {len(tokens)}")
+
+    before = fetch_stats(base_url)
+    latencies.clear()
+    api_metrics = ApiMetrics()
+    with tempfile.TemporaryDirectory() as results_dir:
+        started = time.perf_counter()
+        posts_df, comments_df = get_vk_newsfeed(
+            queries, BENCHMARK_START, BENCHMARK_START + datetime.timedelta(hours=args.hours), tokens,
+            args.comments, lambda progress, text: None, args.mode, args.step,
+            adaptive=args.adaptive, search_pages=args.search_pages, comment_pages=args.comment_pages,
+            engine=args.engine, concurrency=args.concurrency, results_dir=results_dir, metrics=api_metrics
+        )
+        elapsed = time.perf_counter() - started
+    after = fetch_stats(base_url)
+
+    requests_made = after['http_requests'] - before['http_requests']
+    rate_limited = after['rate_limited'] - before['rate_limited']
+    injected_errors = after['injected_errors'] - before['injected_errors']
+    duplicate_calls = after['duplicate_calls'] - before['duplicate_calls']
+    failed_calls = after['failed_calls'] - before['failed_calls']
+    calls_by_method = {
+        method: count - before['calls_by_method'].get(method, 0)
+        for method, count in after['calls_by_method'].items()
+        if count - before['calls_by_method'].get(method, 0)
+    }
+    return {
+        'elapsed_seconds': round(elapsed, 3),
+        'requests': requests_made,
+        'requests_per_second': round(requests_made / elapsed, 1),
+        'api_calls': sum(calls_by_method.values()),
+        'calls_by_method': calls_by_method,
+        'posts': len(posts_df),
+        'posts_per_second': round(len(posts_df) / elapsed, 1),
+        'comments': len(comments_df),
+        'latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        # ru_maxrss в Linux измеряется в килобайтах; имитатор работает в другом процессе и сюда не входит
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        # Впустую: отклонённые ошибкой 6 запросы и повторные вызовы с уже отданным ответом
+        'wasted_requests': rate_limited + injected_errors + duplicate_calls + failed_calls,
+        'rate_limited': rate_limited,
+        'injected_errors': injected_errors,
+        'duplicate_calls': duplicate_calls,
+        'failed_calls': failed_calls,
+        # Как те же потери видит сам парсер
+        'client_retries': api_metrics.retries,
+        'token_wait_seconds': round(api_metrics.token_wait_seconds, 1),
+    }
+
+def print_metrics(metrics, baseline=None):
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            continue
+        line = f"{name:22} {value}"
+        if baseline and isinstance(baseline.get(name), (int, float)) and baseline[name]:
+            change = (value - baseline[name]) / baseline[name]
+            line += f"  (было {baseline[name]}, {change:+.1%})"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--label", default="", help="метка запуска в JSON")
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--hours", type=int, default=24, help="длина периода парсинга")
+    parser.add_argument("--step", type=int, default=1, help="шаг парсинга в часах")
+    parser.add_argument("--mode", choices=("exact", "partial"), default="exact")
+    parser.add_argument("--comments", action="store_true")
+    parser.add_argument("--adaptive", action="store_true")
+    parser.add_argument("--engine", choices=("threads", "async"), default="threads")
+    parser.add_argument("--concurrency", type=int, default=vk_scraper.ASYNC_CONCURRENCY)
+    parser.add_argument("--search-pages", type=int, default=vk_scraper.NEWSFEED_MAX_PAGES)
+    parser.add_argument("--comment-pages", type=int, default=vk_scraper.COMMENTS_MAX_PAGES)
+    parser.add_argument("--tokens", type=int, default=10)
+    parser.add_argument("--rate-limit", type=int, default=vk_scraper.TOKEN_RATE_LIMIT, help="запросов в секунду на токен у имитатора")
+    parser.add_argument("--latency", type=float, default=0.05, help="средняя задержка ответа (секунды)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="разброс задержки (секунды)")
+    parser.add_argument("--call-latency", type=float, default=0.002, help="добавка к задержке за каждый вызов внутри execute")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="доля запросов, на которые отвечается ошибка 6")
+    parser.add_argument("--posts-per-hour", type=int, default=300)
+    parser.add_argument("--match-rate", type=float, default=0.3, help="доля постов, содержащих один из запросов")
+    parser.add_argument("--comments-per-post", type=float, default=20, help="среднее число комментариев к посту")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="файл JSON с результатом (по умолчанию benchmarks/results/vk_api_<время>.json)")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения метрик")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+    queries = make_queries(args.queries, random.Random(args.seed))
+    server_config = {
+        'queries': queries,
+        'seed': args.seed,
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'call_latency': args.call_latency,
+        'rate_limit': args.rate_limit,
+        'error_rate': args.error_rate,
+        'posts_per_hour': args.posts_per_hour,
+        'match_rate': args.match_rate,
+        'comments_per_post': args.comments_per_post,
+    }
+
+    # Имитатор в отдельном процессе не делит GIL и память с измеряемым парсером
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(server_config, port_queue), daemon=True)
+    server.start()
+    try:
+        metrics = run_benchmark(args, queries, f"http://127.0.0.1:{port_queue.get(timeout=10)}")
+    finally:
+        server.terminate()
+
+    result = {
+        'label': args.label,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'label')},
+        'metrics': metrics,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"vk_api_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as output_file:
+        json.dump(result, output_file, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)['metrics']
+    print_metrics(metrics, baseline)
+    print(f"Результат сохранён в {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Запуск парсера VK без Streamlit: из cron, в нескольких процессах или на нескольких машинах.
+
+Работа делится на шарды по стабильному хешу начала окна (все запросы окна попадают
+в один шард), поэтому одинаковые параметры на разных машинах дают непересекающиеся
+части. Пример:
+
+    python cli.py --queries-file queries.txt --tokens-file tokens.txt \\
+        --start 2024-01-01T00:00 --end 2024-02-01T00:00 --output results/backfill \\
+        --shard-index 0 --shard-count 2 --processes 4
+
+Каждый шард пишет posts.parquet и comments.parquet в свой подкаталог --output,
+сводка по шардам печатается в stdout в формате JSON. Метрики запросов к VK
+(задержки по методам и токенам, коды ошибок, повторы) по ходу работы обновляются
+в metrics.json шарда. Для ежечасного мониторинга из cron подходит --incremental
+без --end: каждый запуск пишет только новое в отдельный каталог шарда.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from vk_scraper import (
+    ASYNC_CONCURRENCY,
+    COMMENTS_MAX_PAGES,
+    NEWSFEED_MAX_PAGES,
+    ApiMetrics,
+    CheckpointStore,
+    MonitorState,
+    ResponseCache,
+    TokenStatusCache,
+    run_scrape,
+    validate_tokens,
+)
+
+def read_lines(path):
+    with open(path, encoding='utf-8') as lines_file:
+        return [line.strip() for line in lines_file if line.strip()]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--query", action="append", default=[], help="поисковый запрос (можно повторять)")
+    parser.add_argument("--queries-file", help="файл с запросами, по одному на строку")
+    parser.add_argument("--tokens-file", required=True, help="файл с токенами VK API, по одному на строку")
+    parser.add_argument("--start", required=True, type=datetime.datetime.fromisoformat, help="начало периода, например 2024-01-01T00:00")
+    parser.add_argument("--end", type=datetime.datetime.fromisoformat, default=datetime.datetime.now(), help="конец периода (по умолчанию - сейчас)")
+    parser.add_argument("--output", required=True, help="каталог для результатов шардов")
+    parser.add_argument("--step", type=int, default=1, help="шаг парсинга в часах")
+    parser.add_argument("--mode", choices=("exact", "partial"), default="exact", help="режим сравнения текста с запросом")
+    parser.add_argument("--comments", action="store_true", help="собирать комментарии")
+    parser.add_argument("--expand-threads", action="store_true", help="разворачивать ветки ответов")
+    parser.add_argument("--search-pages", type=int, default=NEWSFEED_MAX_PAGES)
+    parser.add_argument("--comment-pages", type=int, default=COMMENTS_MAX_PAGES)
+    parser.add_argument("--adaptive", action="store_true", help="адаптивная ширина окна")
+    parser.add_argument("--engine", choices=("threads", "async"), default="threads")
+    parser.add_argument("--concurrency", type=int, default=ASYNC_CONCURRENCY)
+    parser.add_argument("--resume", action="store_true", help="продолжить с контрольной точки шарда (кроме --incremental)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="искать только новое с прошлого запуска; --start задаёт начало первого запуска")
+    parser.add_argument("--skip-validation", action="store_true", help="не проверять токены перед запуском")
+    parser.add_argument("--response-cache", help="файл SQLite для кэша ответов VK API")
+    parser.add_argument("--offline", action="store_true",
+                        help="брать ответы только из --response-cache, не обращаясь к VK (воспроизведение записи)")
+    parser.add_argument("--shard-index", type=int, default=0, help="номер этой машины среди --shard-count")
+    parser.add_argument("--shard-count", type=int, default=1, help="сколько машин делят работу")
+    parser.add_argument("--processes", type=int, default=1, help="сколько процессов запустить на этой машине")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="как часто печатать прогресс и обновлять metrics.json (секунды)")
+    args = parser.parse_args(argv)
+
+    if args.queries_file:
+        args.query.extend(read_lines(args.queries_file))
+    if not args.query:
+        parser.error("нужен хотя бы один запрос (--query или --queries-file)")
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error("--shard-index должен быть от 0 до --shard-count - 1")
+    if args.offline and not args.response_cache:
+        parser.error("--offline требует --response-cache")
+    if args.end <= args.start:
+        parser.error("--end должен быть позже --start")
+    return args
+
+def stderr_progress(shard_name, interval, metrics, metrics_path):
+    """Печатает прогресс и сводку метрик в stderr и обновляет файл метрик не чаще раза в interval секунд."""
+    last_printed = [0.0]
+
+    def on_progress(progress, text):
+        now = time.monotonic()
+        if now - last_printed[0] >= interval or progress >= 1.0:
+            last_printed[0] = now
+            snapshot = metrics.snapshot()
+            errors = ", ".join(f"{code}: {count}" for code, count in snapshot['error_codes'].items()) or "нет"
+            print(
+                f"[{shard_name}] " + text.replace("\n", " | ") +
+                f" | 📡 {snapshot['requests_per_second']} запр/с, повторов {snapshot['retries']}, ошибки VK: {errors}",
+                file=sys.stderr, flush=True
+            )
+            metrics.save(metrics_path)
+    return on_progress
+
+def run_shard(args, tokens, shard):
+    shard_name = f"shard-{shard[0]}-of-{shard[1]}"
+    shard_dir = os.path.join(args.output, shard_name)
+    monitor = None
+    if args.incremental:
+        # Каждый инкрементальный запуск пишет свой каталог, а состояние между запусками лежит рядом
+        os.makedirs(shard_dir, exist_ok=True)
+        monitor = MonitorState(os.path.join(shard_dir, "monitor_state.sqlite"))
+        shard_dir = os.path.join(shard_dir, args.end.strftime('%Y%m%d_%H%M%S'))
+    os.makedirs(shard_dir, exist_ok=True)
+
+    # Инкрементальному запуску контрольная точка не нужна: каталог у каждого запуска свой,
+    # а незавершённую работу переносит в следующий запуск состояние монитора
+    checkpoint = None
+    if not args.incremental:
+        checkpoint_path = os.path.join(shard_dir, "checkpoint.sqlite")
+        if os.path.exists(checkpoint_path) and not args.resume:
+            os.remove(checkpoint_path)
+        checkpoint = CheckpointStore(checkpoint_path)
+
+    # SQLite-файл кэша общий для процессов машины, каждый процесс открывает своё соединение
+    response_cache = ResponseCache(args.response_cache, offline=args.offline) if args.response_cache else None
+
+    metrics = ApiMetrics()
+    metrics_path = os.path.join(shard_dir, "metrics.json")
+
+    started = time.time()
+    results = run_scrape(
+        args.query, args.start, args.end, tokens, args.comments,
+        stderr_progress(shard_name, args.progress_interval, metrics, metrics_path), args.mode, args.step,
+        adaptive=args.adaptive, search_pages=args.search_pages, comment_pages=args.comment_pages,
+        expand_threads=args.expand_threads, engine=args.engine, concurrency=args.concurrency,
+        checkpoint=checkpoint, results_dir=shard_dir, shard=shard, monitor=monitor,
+        response_cache=response_cache, metrics=metrics
+    )
+    metrics.save(metrics_path)
+    if checkpoint:
+        checkpoint.close()
+        if results.complete:
+            # Контрольная точка нужна только для продолжения незавершённого шарда
+            os.remove(checkpoint_path)
+    if monitor:
+        monitor.close()
+    if response_cache:
+        response_cache.close()
+
+    return {
+        'shard': shard_name,
+        'posts': results.post_count,
+        'comments': results.comment_count,
+        # Окна и посты, запросы по которым не удались: их дособирает повторный запуск
+        # с --resume, а в инкрементальном режиме - следующий запуск
+        'unfinished_units': len(results.unfinished_units),
+        'unfinished_posts': len(results.unfinished_posts),
+        'posts_path': results.posts_path,
+        'comments_path': results.comments_path,
+        'metrics_path': metrics_path,
+        'elapsed_seconds': round(time.time() - started, 1),
+        'cache_hits': response_cache.hits if response_cache else 0,
+        'cache_misses': response_cache.misses if response_cache else 0,
+    }
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    args = parse_args(argv)
+
+    tokens = read_lines(args.tokens_file)
+    if not args.skip_validation and not args.offline:
+        tokens, invalid_tokens = validate_tokens(tokens, TokenStatusCache())
+        if invalid_tokens:
+            print(f"Невалидных токенов: {len(invalid_tokens)}", file=sys.stderr)
+    if len(tokens) < args.processes:
+        raise SystemExit(f"Нужно хотя бы по одному валидному токену на процесс: токенов {len(tokens)}, процессов {args.processes}")
+
+    # Машина с номером shard_index берёт шарды shard_index * processes ... + processes - 1;
+    # токены делятся между процессами, чтобы не превышать лимит VK на один токен
+    shard_count = args.shard_count * args.processes
+    shards = [(args.shard_index * args.processes + process, shard_count) for process in range(args.processes)]
+    token_groups = [tokens[process::args.processes] for process in range(args.processes)]
+
+    if args.processes == 1:
+        summary = [run_shard(args, token_groups[0], shards[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            summary = list(executor.map(run_shard, [args] * args.processes, token_groups, shards))
+
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
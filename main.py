@@ -1,147 +1,150 @@
 import streamlit as st
-import requests
 import pandas as pd
-import time
+import numpy as np
 import datetime
-import re
-import random
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-def get_unixtime_from_datetime(dt):
-    return int(time.mktime(dt.timetuple()))
-
-def get_comments(post_id, owner_id, access_tokens):
-    # Randomly select one token from the pool
-    access_token = random.choice(access_tokens)
-    
-    url = (
-        f"https://api.vk.com/method/wall.getComments?"
-        f"owner_id={owner_id}&post_id={post_id}&access_token={access_token}&v=5.131"
-    )
-    try:
-        res = requests.get(url)
-        json_text = res.json()
-        return json_text.get('response', {}).get('items', [])
-    except Exception as e:
-        st.error(f"Ошибка при получении комментариев: {e}")
-        return []
-
-def execute_query(query, start_time, end_time, access_tokens, include_comments, search_mode):
-    # Randomly select one token from the pool for load balancing
-    access_token = random.choice(access_tokens)
-    
-    url = (
-        f"https://api.vk.com/method/newsfeed.search?q={query}"
-        f"&count=200"
-        f"&access_token={access_token}"
-        f"&start_time={start_time}"
-        f"&end_time={end_time}"
-        f"&v=5.131"
-    )
-
-    posts = []
-    comments = []
-
-    try:
-        res = requests.get(url)
-        json_text = res.json()
+import math
+import os
+import time
 
-        if 'response' in json_text and 'items' in json_text['response']:
-            for item in json_text['response']['items']:
-                if search_mode == 'exact':
-                    if re.search(r'\b' + re.escape(query) + r'\b', item.get('text', ''), re.IGNORECASE):
-                        item['matched_query'] = query
-                        posts.append(item)
-                else:
-                    if query.lower() in item.get('text', '').lower():
-                        item['matched_query'] = query
-                        posts.append(item)
-
-                if include_comments:
-                    post_comments = get_comments(item['id'], item['owner_id'], access_tokens)
-                    for comment in post_comments:
-                        comment['post_id'] = item['id']
-                        comment['post_owner_id'] = item['owner_id']
-                    comments.extend(post_comments)
-
-    except Exception as e:
-        st.error(f"Ошибка при выполнении запроса: {e}")
-
-    return posts, comments
-
-def get_vk_newsfeed(queries, start_datetime, end_datetime, access_tokens, include_comments, progress_bar, status_text, time_sleep, search_mode, time_step):
-    all_posts = []
-    all_comments = []
-
-    delta = datetime.timedelta(hours=time_step)
-    current_time = start_datetime
-
-    total_steps = int((end_datetime - start_datetime) / delta)
-    step_count = 0
-
-    start_time = time.time()
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        while current_time < end_datetime:
-            step_count += 1
-            futures = []
-            for query in queries:
-                end_time = min(current_time + delta, end_datetime)
-                futures.append(executor.submit(
-                    execute_query, 
-                    query, 
-                    get_unixtime_from_datetime(current_time),
-                    get_unixtime_from_datetime(end_time),
-                    access_tokens, 
-                    include_comments, 
-                    search_mode
-                ))
-
-            for future in as_completed(futures):
-                posts, comments = future.result()
-                all_posts.extend(posts)
-                all_comments.extend(comments)
-
-            progress = step_count / total_steps
-            progress_bar.progress(progress)
-
-            elapsed_time = time.time() - start_time
-            eta = (elapsed_time / progress) - elapsed_time if progress > 0 else 0
-
-            status_text.text(
-                f"⏳ Прогресс: {progress:.2%} | ⌛ Прошло времени: {elapsed_time:.1f} сек\n"
-                f"📊 Найдено постов: {len(all_posts)} | 💬 Комментариев: {len(all_comments)}\n"
-                f"🕒 Текущая дата: {current_time} | ⏱️ Осталось примерно: {eta/60:.1f} мин"
+from vk_scraper import (
+    ASYNC_CONCURRENCY,
+    COMMENTS_MAX_PAGES,
+    DEDUP_INDEX_PATH,
+    MONITOR_STATE_PATH,
+    NEWSFEED_MAX_PAGES,
+    RESPONSE_CACHE_PATH,
+    ApiMetrics,
+    CheckpointStore,
+    DedupIndex,
+    MonitorState,
+    ResponseCache,
+    ResultWriter,
+    TokenStatusCache,
+    export_csv,
+    run_scrape,
+    validate_tokens,
+)
+
+# Как часто (секунды) перерисовывать панель метрик во время парсинга
+METRICS_PANEL_INTERVAL = 1.0
+
+# Форматы выгрузки результатов: расширение файла и MIME-тип
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "CSV.gz": ("csv.gz", "application/gzip"),
+    "Parquet": ("parquet", "application/octet-stream"),
+}
+
+def metrics_frame(histograms):
+    frame = pd.DataFrame.from_dict(histograms, orient='index')
+    if frame.empty:
+        return frame
+    frame['bytes_received'] = (frame['bytes_received'] / 1024 / 1024).round(2)
+    frame = frame[['requests', 'errors', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms', 'bytes_received']]
+    frame.columns = ['Запросов', 'Ошибок', 'Среднее, мс', 'p50, мс', 'p95, мс', 'Макс, мс', 'Получено, МБ']
+    return frame
+
+def render_metrics(snapshot):
+    """Панель метрик запросов: общие счётчики и задержки по методам и токенам."""
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("📡 Запросов", snapshot['requests'], f"{snapshot['requests_per_second']} в сек", delta_color="off")
+    col2.metric("🔁 Повторов", snapshot['retries'])
+    col3.metric("⏳ Ожидание токенов", f"{snapshot['token_wait_seconds']} сек")
+    col4.metric("📦 Получено", f"{snapshot['bytes_received'] / 1024 / 1024:.1f} МБ")
+    col5.metric("⚠️ Ошибок VK", sum(snapshot['error_codes'].values()))
+    if snapshot['error_codes']:
+        st.write("Коды ошибок: " + ", ".join(f"{code}: {count}" for code, count in snapshot['error_codes'].items()))
+    st.write("По методам:")
+    st.dataframe(metrics_frame(snapshot['methods']))
+    st.write("По токенам:")
+    st.dataframe(metrics_frame(snapshot['tokens']))
+
+def streamlit_progress(progress_bar, status_text, metrics=None, metrics_panel=None):
+    """Колбэк прогресса движка, который обновляет полосу и текст статуса Streamlit,
+    а раз в METRICS_PANEL_INTERVAL секунд - панель метрик запросов."""
+    last_rendered = [0.0]
+
+    def on_progress(progress, text):
+        progress_bar.progress(min(progress, 1.0))
+        status_text.text(text)
+        if metrics and time.monotonic() - last_rendered[0] >= METRICS_PANEL_INTERVAL:
+            last_rendered[0] = time.monotonic()
+            with metrics_panel.container():
+                render_metrics(metrics.snapshot())
+    return on_progress
+
+def render_downloads(parquet_path, file_stem, label):
+    """Выгрузка по запросу: формат выбирается списком, файл готовится кнопкой.
+
+    download_button читает файл целиком в память Streamlit при каждом перезапуске скрипта,
+    поэтому кнопка скачивания создаётся только для одного подготовленного файла и убирается
+    после скачивания.
+    """
+    prepared_key = f"prepared_{file_stem}"
+    col1, col2 = st.columns(2)
+    with col1:
+        title = st.selectbox(f"Формат выгрузки ({label})", list(EXPORT_FORMATS), key=f"format_{file_stem}")
+    extension, mime = EXPORT_FORMATS[title]
+    file_name = f"{file_stem}.{extension}"
+    with col2:
+        if st.button(f"📦 Подготовить {label} ({title})", key=f"prepare_{file_stem}"):
+            path = parquet_path if extension == 'parquet' else os.path.join(os.path.dirname(parquet_path), file_name)
+            if not os.path.exists(path):
+                with st.spinner("Подготовка файла..."):
+                    export_csv(parquet_path, path)
+            st.session_state[prepared_key] = (parquet_path, title, path)
+
+    # Подготовленный файл показывается, только пока выбраны тот же результат и формат
+    prepared = st.session_state.get(prepared_key)
+    if prepared and prepared[:2] == (parquet_path, title):
+        with open(prepared[2], 'rb') as export_file:
+            downloaded = st.download_button(
+                label=f"📥 Скачать {label} ({title})",
+                data=export_file,
+                file_name=file_name,
+                mime=mime,
+                key=f"download_{file_stem}",
             )
+        if downloaded:
+            del st.session_state[prepared_key]
+
+# Производные таблицы кэшируются по results_key (каталог запуска): DataFrame в аргументах
+# с подчёркиванием Streamlit не хэширует, поэтому клик по виджету не пересчитывает их заново
+@st.cache_data(max_entries=4)
+def daily_post_counts(results_key, _posts):
+    date_counts = _posts['date'].dt.floor('D').value_counts().sort_index()
+    return date_counts.rename_axis('Дата').to_frame('Количество постов')
+
+@st.cache_data(max_entries=4)
+def query_post_counts(results_key, _posts):
+    return _posts['matched_query'].explode().value_counts()
+
+@st.cache_data(max_entries=4)
+def engagement_frame(results_key, _posts):
+    return pd.DataFrame(
+        {'Лайки': _posts['likes_count'].to_numpy(), 'Репосты': _posts['reposts_count'].to_numpy()},
+        index=pd.RangeIndex(1, len(_posts) + 1, name='Пост'),
+    )
 
-            current_time += delta
-            time.sleep(time_sleep)
+@st.cache_data(max_entries=16)
+def sorted_positions(results_key, _posts, sort_column, ascending):
+    """Позиции строк в порядке сортировки; сам DataFrame не копируется."""
+    return _posts.index.get_indexer(_posts[sort_column].sort_values(ascending=ascending, kind='stable').index)
 
-    df = pd.DataFrame(all_posts)
-    comments_df = pd.DataFrame(all_comments)
+@st.cache_data(max_entries=16)
+def query_positions(results_key, _posts, query):
+    matched = _posts['matched_query'].explode()
+    return _posts.index.get_indexer(matched.index[matched == query].unique())
 
-    return df, comments_df
+@st.cache_resource(max_entries=4)
+def comment_row_index(results_key, _comments):
+    """{(post_owner_id, post_id): позиции строк комментариев}, строится один раз на результат.
 
-def validate_tokens(tokens):
-    valid_tokens = []
-    invalid_tokens = []
-    
-    for token in tokens:
-        if not token.strip():
-            continue
-            
-        url = f"https://api.vk.com/method/users.get?access_token={token}&v=5.131"
-        try:
-            response = requests.get(url)
-            result = response.json()
-            if 'response' in result:
-                valid_tokens.append(token)
-            else:
-                invalid_tokens.append(token)
-        except:
-            invalid_tokens.append(token)
-    
-    return valid_tokens, invalid_tokens
+    cache_resource отдаёт один и тот же словарь без копирования при каждом обращении.
+    """
+    if _comments.empty:
+        return {}
+    return _comments.groupby(['post_owner_id', 'post_id'], sort=False).indices
 
 def main():
     st.set_page_config(page_title="VK Parser", page_icon="📊", layout="wide")
@@ -170,18 +173,24 @@ def main():
            - Выберите режим поиска (точная фраза или частичное совпадение)
            - Укажите, нужно ли включать комментарии (это может значительно увеличить время парсинга)
            - Установите шаг парсинга (в часах). Меньший шаг даёт более точные результаты, но увеличивает время работы
+           - Включите адаптивный шаг, чтобы парсер сам делил переполненные окна и объединял пустые: шаг парсинга тогда задаёт только начальную ширину окна
+           - Асинхронный движок держит много запросов одновременно поверх нескольких keep-alive соединений и быстрее работает на длинных периодах
+           - Готовые окна сохраняются в контрольную точку: после перезагрузки страницы запустите парсинг с теми же параметрами, и он продолжится с места остановки
+           - Инкрементальный режим для регулярного мониторинга ищет каждый запрос от последнего найденного поста до текущего момента и дособирает только новые комментарии; дата начала нужна лишь для первого запуска
         
         5. 🚀 **Запустите парсинг**:
            - Нажмите кнопку "Начать парсинг"
            - Следите за прогрессом в статус-баре
+           - Панель метрик под ним показывает задержки запросов по методам и токенам, коды ошибок VK, повторы и время ожидания токенов: по ней видно, упирается ли парсинг в лимиты VK, нерабочий токен или сбор комментариев
         
         6. 📊 **Анализируйте результаты**:
            - Просматривайте данные в таблицах "Посты" и "Комментарии"
            - Используйте фильтры и сортировку для анализа данных
-           - Загрузите результаты в CSV формате для дальнейшего анализа
+           - Выберите формат (CSV, сжатый CSV.gz или Parquet), нажмите "Подготовить" и скачайте результаты для дальнейшего анализа
         
         ⚠️ **Важно**: 
         - VK API ограничивает количество постов до 200 на один запрос
+        - Парсер листает выдачу по next_from (до 1000 постов на окно) и комментарии страницами по 100; число страниц ограничивается настройками
         - Большой шаг парсинга может привести к потере данных для популярных запросов
         - Маленький шаг увеличивает точность, но замедляет работу парсера
         - Использование нескольких токенов ускоряет работу и снижает риск блокировки
@@ -193,6 +202,7 @@ def main():
     if 'validated_tokens' not in st.session_state:
         st.session_state.validated_tokens = []
     
+    token_cache = TokenStatusCache()
     validate_button = st.button("✅ Проверить токены")
     
     if validate_button:
@@ -201,7 +211,7 @@ def main():
             st.error("Пожалуйста, введите хотя бы один токен.")
         else:
             with st.spinner("Проверка токенов..."):
-                valid_tokens, invalid_tokens = validate_tokens(tokens_list)
+                valid_tokens, invalid_tokens = validate_tokens(tokens_list, token_cache)
                 st.session_state.validated_tokens = valid_tokens
                 
                 if valid_tokens:
@@ -225,11 +235,24 @@ def main():
     end_datetime = datetime.datetime.combine(end_date, end_time)
     
     include_comments = st.checkbox("💬 Включить комментарии", value=True)
-    time_sleep = st.slider("⏱️ Пауза между запросами (секунды)", min_value=0.1, max_value=2.0, value=0.5, step=0.1)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        search_pages = st.number_input("📄 Страниц поиска на окно", min_value=1, max_value=NEWSFEED_MAX_PAGES, value=NEWSFEED_MAX_PAGES)
+    with col2:
+        comment_pages = st.number_input("📄 Страниц комментариев на пост (по 100)", min_value=1, max_value=50, value=COMMENTS_MAX_PAGES)
+    with col3:
+        expand_threads = st.checkbox("🧵 Разворачивать ветки ответов", value=False)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        engine = st.radio("⚙️ Движок запросов:", ["Потоки", "Асинхронный (aiohttp)"])
+    with col2:
+        concurrency = st.number_input("🚦 Запросов одновременно (асинхронный движок)", min_value=1, max_value=1000, value=ASYNC_CONCURRENCY)
 
     search_mode = st.radio("🔍 Режим поиска:", ["Точная фраза", "Частичное совпадение"])
     
     time_step = st.slider("📊 Шаг парсинга (часы)", min_value=1, max_value=24, value=1, step=1)
+    adaptive = st.checkbox("🧠 Адаптивный шаг (делить переполненные окна и объединять редкие)", value=False)
     
     if 'full_df' not in st.session_state:
         st.session_state.full_df = None
@@ -240,6 +263,11 @@ def main():
     if 'token_stats' not in st.session_state:
         st.session_state.token_stats = {}
 
+    resume = st.checkbox("♻️ Продолжить прерванный парсинг с теми же параметрами (контрольная точка)", value=True)
+    persist_dedup = st.checkbox("🧷 Не скачивать повторно комментарии к постам из прошлых запусков", value=False)
+    use_response_cache = st.checkbox("🗄️ Кэшировать ответы VK API на диске (повторный парсинг тех же окон не тратит запросы)", value=True)
+    incremental = st.checkbox("🔁 Инкрементальный режим: только новые посты и комментарии с прошлого запуска (до текущего момента)", value=False)
+
     start_parsing = st.button("🚀 Начать парсинг")
 
     if start_parsing:
@@ -251,6 +279,9 @@ def main():
             st.error("Пожалуйста, заполните все поля.")
             return
 
+        if incremental:
+            end_datetime = datetime.datetime.now()
+
         if (end_datetime - start_datetime).total_seconds() < 3600:
             st.error("Минимальный период парсинга должен быть не менее 1 часа.")
             return
@@ -259,25 +290,77 @@ def main():
 
         progress_bar = st.progress(0)
         status_text = st.empty()
+        metrics = ApiMetrics()
+        metrics_panel = st.empty()
 
         token_count = len(st.session_state.validated_tokens)
         st.info(f"🔑 Парсинг будет выполнен с использованием {token_count} токенов.")
         
+        search_mode_key = 'exact' if search_mode == "Точная фраза" else 'partial'
+        # Инкрементальному режиму контрольная точка не нужна: незавершённые окна и посты
+        # остаются за отметками состояния, и их дособирает следующий запуск
+        checkpoint = None
+        if not incremental:
+            checkpoint_path = CheckpointStore.job_path(
+                queries_list, start_datetime, end_datetime, time_step, search_mode_key, include_comments,
+                adaptive, search_pages, comment_pages, expand_threads
+            )
+            if os.path.exists(checkpoint_path):
+                if resume:
+                    st.info("♻️ Найдена контрольная точка: готовые окна будут пропущены.")
+                else:
+                    os.remove(checkpoint_path)
+            checkpoint = CheckpointStore(checkpoint_path)
+        results_dir = ResultWriter.new_run_dir()
+        dedup_index = DedupIndex(DEDUP_INDEX_PATH if persist_dedup else None)
+        monitor = MonitorState(MONITOR_STATE_PATH) if incremental else None
+        response_cache = ResponseCache(RESPONSE_CACHE_PATH) if use_response_cache else None
+
         status_text.text("Парсинг начался...")
-        df, comments_df = get_vk_newsfeed(queries_list, start_datetime, end_datetime, 
-                                          st.session_state.validated_tokens, include_comments, 
-                                          progress_bar, status_text, time_sleep,
-                                          'exact' if search_mode == "Точная фраза" else 'partial', time_step)
+        results = run_scrape(queries_list, start_datetime, end_datetime, 
+                             st.session_state.validated_tokens, include_comments, 
+                             streamlit_progress(progress_bar, status_text, metrics, metrics_panel),
+                             search_mode_key, time_step,
+                             st.session_state.token_stats, adaptive,
+                             search_pages, comment_pages, expand_threads,
+                             'async' if engine == "Асинхронный (aiohttp)" else 'threads', concurrency,
+                             checkpoint, results_dir, dedup_index, token_cache,
+                             monitor=monitor, response_cache=response_cache, metrics=metrics)
+        df, comments_df = results.read_frames()
+        # Итоговые метрики остаются во вкладке статистики, живая панель больше не нужна
+        metrics_panel.empty()
+        st.session_state.api_metrics = metrics.snapshot()
+        if checkpoint:
+            checkpoint.close()
+            if results.complete:
+                # Завершённый парсинг не нужно продолжать: повторный запуск начнётся заново
+                os.remove(checkpoint_path)
+        if not results.complete:
+            st.warning(
+                f"⚠️ Не удалось обработать окон: {len(results.unfinished_units)}, собрать комментарии к постам: "
+                f"{len(results.unfinished_posts)}. " +
+                ("Следующий запуск дособерёт их." if incremental else "Запустите парсинг с теми же параметрами, чтобы дособрать их.")
+            )
+        if monitor:
+            monitor.close()
+        if response_cache:
+            response_cache.close()
+            st.info(f"🗄️ Кэш ответов: из кэша {response_cache.hits}, из сети {response_cache.misses}")
+        dedup_index.save()
         status_text.text("Парсинг завершен!")
 
-        if not df.empty:
+        # В инкрементальном режиме новыми могут оказаться только комментарии к старым постам
+        if not df.empty or not comments_df.empty:
             df['date'] = pd.to_datetime(df['date'], unit='s')
             
-            columns_order = ['matched_query', 'text', 'date', 'id', 'owner_id', 'from_id', 'likes', 'reposts', 'views', 'comments']
+            columns_order = ['matched_query', 'text', 'date', 'id', 'owner_id', 'from_id', 'likes_count', 'reposts_count', 'views_count', 'comments_count']
             df = df.reindex(columns=columns_order + [col for col in df.columns if col not in columns_order])
 
             st.session_state.full_df = df
             st.session_state.comments_df = comments_df
+            st.session_state.results_dir = results_dir
+            # Отпечаток результата для кэша производных таблиц: каталог уникален для каждого запуска
+            st.session_state.results_key = results_dir
         else:
             st.warning("Данные не найдены для указанных параметров.")
 
@@ -307,51 +390,41 @@ def main():
             with col2:
                 # Статистика по запросам
                 if not st.session_state.full_df.empty and 'matched_query' in st.session_state.full_df.columns:
-                    query_counts = st.session_state.full_df['matched_query'].value_counts()
+                    query_counts = query_post_counts(st.session_state.results_key, st.session_state.full_df)
                     st.write("🔍 Распределение по запросам:")
                     for query, count in query_counts.items():
                         st.write(f"- **{query}**: {count} постов")
-            
+
+                # Статистика использования токенов
+                if st.session_state.token_stats:
+                    st.write("🔑 Использование токенов:")
+                    token_stats_df = pd.DataFrame.from_dict(st.session_state.token_stats, orient='index')
+                    token_stats_df.columns = ['Запросов', 'Ошибок', 'Ограничений скорости', 'Состояние']
+                    st.dataframe(token_stats_df)
+
+            if st.session_state.get('api_metrics'):
+                with st.expander("📡 Метрики запросов к VK API"):
+                    render_metrics(st.session_state.api_metrics)
+
             # Статистика по активности
             if not st.session_state.full_df.empty:
                 st.subheader("📊 Активность по дням")
                 if 'date' in st.session_state.full_df.columns:
-                    df_by_date = st.session_state.full_df.copy()
-                    df_by_date['date_only'] = df_by_date['date'].dt.date
-                    date_counts = df_by_date.groupby('date_only').size().reset_index(name='count')
-                    date_counts.columns = ['Дата', 'Количество постов']
-                    st.bar_chart(date_counts.set_index('Дата'))
+                    st.bar_chart(daily_post_counts(st.session_state.results_key, st.session_state.full_df))
                 
                 # Статистика по лайкам и репостам
-                if 'likes' in st.session_state.full_df.columns and isinstance(st.session_state.full_df['likes'].iloc[0], dict):
+                if 'likes_count' in st.session_state.full_df.columns:
                     st.subheader("👍 Статистика по вовлеченности")
-                    engagement_df = pd.DataFrame({
-                        'Пост': range(1, len(st.session_state.full_df) + 1),
-                        'Лайки': [post.get('count', 0) if isinstance(post, dict) else 0 for post in st.session_state.full_df['likes']],
-                        'Репосты': [post.get('count', 0) if isinstance(post, dict) else 0 for post in st.session_state.full_df['reposts']]
-                    })
-                    st.line_chart(engagement_df.set_index('Пост')[['Лайки', 'Репосты']])
+                    st.line_chart(engagement_frame(st.session_state.results_key, st.session_state.full_df))
         
         with tab2:
             st.dataframe(st.session_state.full_df)
-            csv = st.session_state.full_df.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                label="📥 Скачать посты (CSV)",
-                data=csv,
-                file_name="vk_posts.csv",
-                mime="text/csv",
-            )
+            render_downloads(os.path.join(st.session_state.results_dir, 'posts.parquet'), "vk_posts", "посты")
         
         with tab3:
             if include_comments and not st.session_state.comments_df.empty:
                 st.dataframe(st.session_state.comments_df)
-                comments_csv = st.session_state.comments_df.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="📥 Скачать комментарии (CSV)",
-                    data=comments_csv,
-                    file_name="vk_comments.csv",
-                    mime="text/csv",
-                )
+                render_downloads(os.path.join(st.session_state.results_dir, 'comments.parquet'), "vk_comments", "комментарии")
             else:
                 st.info("Комментарии не были включены в парсинг или не найдены.")
         
@@ -366,50 +439,47 @@ def main():
             
             # Функция для отображения информации о посте
             def display_post_info(post):
-                with st.expander(f"📝 Пост от {post['date'].strftime('%d.%m.%Y %H:%M')} | Запрос: {post['matched_query']}", expanded=False):
+                with st.expander(f"📝 Пост от {post['date'].strftime('%d.%m.%Y %H:%M')} | Запрос: {', '.join(post['matched_query'])}", expanded=False):
                     st.markdown(f"**Текст поста:**\n{post['text']}")
                     
                     col1, col2, col3 = st.columns(3)
                     
                     with col1:
-                        likes = post['likes'].get('count', 0) if isinstance(post['likes'], dict) else 0
-                        st.metric("👍 Лайки", likes)
+                        st.metric("👍 Лайки", post['likes_count'])
                     
                     with col2:
-                        reposts = post['reposts'].get('count', 0) if isinstance(post['reposts'], dict) else 0
-                        st.metric("🔄 Репосты", reposts)
+                        st.metric("🔄 Репосты", post['reposts_count'])
                     
                     with col3:
-                        comments_count = post['comments'].get('count', 0) if isinstance(post['comments'], dict) else 0
-                        st.metric("💬 Комментарии", comments_count)
+                        st.metric("💬 Комментарии", post['comments_count'])
                     
-                    # Отображение комментариев к посту
+                    # Отображение комментариев к посту: строки берутся из индекса, без просмотра всей таблицы
                     if not st.session_state.comments_df.empty:
-                        post_comments = st.session_state.comments_df[
-                            (st.session_state.comments_df['post_id'] == post['id']) & 
-                            (st.session_state.comments_df['post_owner_id'] == post['owner_id'])
-                        ]
+                        comment_rows = comment_index.get((post['owner_id'], post['id']))
                         
-                        if not post_comments.empty:
+                        if comment_rows is not None:
                             st.markdown("### 💬 Комментарии:")
-                            for _, comment in post_comments.iterrows():
+                            post_comments = st.session_state.comments_df.iloc[comment_rows]
+                            for comment in post_comments[['from_id', 'date', 'text']].itertuples(index=False):
                                 st.markdown(f"""
                                 ---
-                                **{comment.get('from_id', 'Пользователь')}** • {datetime.datetime.fromtimestamp(comment.get('date', 0)).strftime('%d.%m.%Y %H:%M')}
+                                **{comment.from_id}** • {datetime.datetime.fromtimestamp(comment.date or 0).strftime('%d.%m.%Y %H:%M')}
                                 
-                                {comment.get('text', '')}
+                                {comment.text or ''}
                                 """)
                         else:
                             st.info("Комментарии к этому посту не найдены.")
             
+            comment_index = comment_row_index(st.session_state.results_key, st.session_state.comments_df)
+
             # Фильтры для просмотра данных
             if not st.session_state.full_df.empty:
-                col1, col2 = st.columns(2)
+                col1, col2, col3 = st.columns(3)
                 
                 with col1:
                     # Фильтр по запросу
                     if 'matched_query' in st.session_state.full_df.columns:
-                        queries = ['Все'] + list(st.session_state.full_df['matched_query'].unique())
+                        queries = ['Все'] + list(query_post_counts(st.session_state.results_key, st.session_state.full_df).index)
                         selected_query = st.selectbox("🔍 Фильтр по запросу:", queries)
                 
                 with col2:
@@ -421,33 +491,28 @@ def main():
                         'По количеству комментариев': ('comments_count', False)
                     }
                     selected_sort = st.selectbox("🔢 Сортировка:", list(sort_options.keys()))
+
+                with col3:
+                    page_size = st.selectbox("📄 Постов на странице:", [10, 25, 50, 100], index=1)
                 
-                # Подготовка данных для отображения
-                display_df = st.session_state.full_df.copy()
-                
-                # Добавление числовых колонок для сортировки
-                if 'likes' in display_df.columns:
-                    display_df['likes_count'] = display_df['likes'].apply(
-                        lambda x: x.get('count', 0) if isinstance(x, dict) else 0
-                    )
-                
-                if 'comments' in display_df.columns:
-                    display_df['comments_count'] = display_df['comments'].apply(
-                        lambda x: x.get('count', 0) if isinstance(x, dict) else 0
-                    )
-                
-                # Применение фильтра по запросу
-                if selected_query != 'Все':
-                    display_df = display_df[display_df['matched_query'] == selected_query]
-                
-                # Применение сортировки
+                # Порядок сортировки и фильтр по запросу берутся из кэша в виде позиций строк
                 sort_column, ascending = sort_options[selected_sort]
-                display_df = display_df.sort_values(by=sort_column, ascending=ascending)
+                positions = sorted_positions(st.session_state.results_key, st.session_state.full_df, sort_column, ascending)
+                if selected_query != 'Все':
+                    matched_positions = query_positions(st.session_state.results_key, st.session_state.full_df, selected_query)
+                    positions = positions[np.isin(positions, matched_positions)]
                 
-                # Отображение постов
-                st.write(f"Найдено постов: {len(display_df)}")
+                # Отображение постов: на странице выводится только page_size постов
+                page_count = max(math.ceil(len(positions) / page_size), 1)
+                # Ключ зависит от фильтра и сортировки, чтобы при их смене просмотр начинался с первой страницы
+                page = st.number_input(
+                    f"Страница (из {page_count}):", min_value=1, max_value=page_count, value=1,
+                    key=f"viewer_page_{selected_query}_{selected_sort}_{page_size}"
+                )
+                st.write(f"Найдено постов: {len(positions)}")
                 
-                for _, post in display_df.iterrows():
+                page_df = st.session_state.full_df.iloc[positions[(page - 1) * page_size:page * page_size]]
+                for _, post in page_df.iterrows():
                     display_post_info(post)
 
 if __name__ == "__main__":
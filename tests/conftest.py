@@ -0,0 +1,77 @@
+"""Общие фикстуры тестов: имитатор VK API из бенчмарка, подключённый к движку без сети."""
+import datetime
+import itertools
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import vk_scraper
+from vk_api_benchmark import FakeVK
+
+START = datetime.datetime(2024, 1, 1)
+QUERIES = ["искусственный интеллект", "метро"]
+
+class FakeResponse:
+    def __init__(self, json_text):
+        self.json_text = json_text
+        self.content = json.dumps(json_text, ensure_ascii=False).encode('utf-8')
+
+    def json(self):
+        return self.json_text
+
+class FakeSession:
+    """Заменяет http_session: запросы уходят прямо в FakeVK.
+
+    fail(method) - запросы execute с вызовами этого метода (или любые, если None)
+    падают с ConnectionError, пока не вызван fail(False).
+    """
+
+    def __init__(self, fake):
+        self.fake = fake
+        self.failing = False
+
+    def fail(self, method=None):
+        self.failing = method
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        if self.failing is None or self.failing and self.failing in data.get('code', method):
+            raise ConnectionError("соединение сброшено")
+        return FakeResponse(self.fake.handle(method, dict(data)))
+
+@pytest.fixture
+def fake_vk(monkeypatch):
+    fake = FakeVK({
+        'queries': QUERIES,
+        'seed': 1,
+        'latency': 0,
+        'jitter': 0,
+        'call_latency': 0,
+        'rate_limit': 1000,
+        'error_rate': 0,
+        'posts_per_hour': 40,
+        'match_rate': 0.5,
+        'comments_per_post': 3,
+    })
+    session = FakeSession(fake)
+    monkeypatch.setattr(vk_scraper, 'http_session', session)
+    return session
+
+@pytest.fixture
+def scrape(tmp_path):
+    """run_scrape по QUERIES за hours часов от START; каждый вызов пишет свой каталог результатов."""
+    run_numbers = itertools.count(1)
+
+    def run(hours=3, **kwargs):
+        return vk_scraper.run_scrape(
+            QUERIES, START, START + datetime.timedelta(hours=hours), [f"token-{index}" for index in range(20)], True,
+            lambda progress, text: None, 'exact', 1,
+            results_dir=str(tmp_path / f"run{next(run_numbers)}"), **kwargs
+        )
+    return run
@@ -0,0 +1,16 @@
+import vk_scraper
+from conftest import QUERIES, START
+from vk_scraper import QueryMatcher, get_unixtime_from_datetime
+
+def test_saturated_minimal_window_is_paged(fake_vk, scrape, monkeypatch):
+    # Около 750 постов за 15 минут: даже окно минимальной ширины не помещается в одну страницу
+    fake_vk.fake.config.update(posts_per_hour=3000, match_rate=1.0, comments_per_post=0)
+    monkeypatch.setattr(vk_scraper, 'ADAPTIVE_MIN_WINDOW', 900)
+    results = scrape(hours=1, adaptive=True)
+
+    matcher = QueryMatcher(QUERIES, 'exact')
+    hour = get_unixtime_from_datetime(START) // 3600
+    expected = {(post['owner_id'], post['id']) for post, _ in fake_vk.fake.hour_posts(hour) if matcher.match(post['text'])}
+    posts, _ = results.read_frames()
+    assert results.complete
+    assert set(zip(posts['owner_id'], posts['id'])) == expected
@@ -0,0 +1,18 @@
+import aiohttp
+
+from vk_scraper import EXECUTE_BATCH_SIZE, AsyncVKEngine, TokenScheduler
+
+def test_failed_chunk_keeps_results_of_other_chunks():
+    calls = [('wall.getComments', {'owner_id': -1, 'post_id': post_id}) for post_id in range(EXECUTE_BATCH_SIZE + 5)]
+    engine = AsyncVKEngine(TokenScheduler(["token"]))
+
+    async def call_raw(method, params):
+        if '"post_id": 0}' in params['code']:
+            raise aiohttp.ClientError("соединение сброшено")
+        return {'response': [{'items': []}] * params['code'].count("API.")}
+    engine._call_raw = call_raw
+
+    with engine:
+        results = engine.call_batch(calls)
+    assert results == [None] * EXECUTE_BATCH_SIZE + [{'items': []}] * 5
+    assert engine.loop.is_closed()
@@ -0,0 +1,63 @@
+from vk_scraper import CheckpointStore
+
+def post_keys(results):
+    posts, _ = results.read_frames()
+    return set(zip(posts['owner_id'], posts['id']))
+
+def comment_ids(results):
+    _, comments = results.read_frames()
+    return set(comments['id'])
+
+def test_failed_search_is_not_saved_as_done(fake_vk, scrape, tmp_path):
+    checkpoint = CheckpointStore(str(tmp_path / "job.sqlite"))
+    fake_vk.fail()
+    results = scrape(checkpoint=checkpoint)
+
+    assert not results.complete
+    assert len(results.unfinished_units) == 6
+    assert checkpoint.done_units() == set()
+
+def test_resume_after_failed_search(fake_vk, scrape, tmp_path):
+    expected = scrape()
+    assert expected.complete and expected.post_count
+
+    checkpoint = CheckpointStore(str(tmp_path / "job.sqlite"))
+    fake_vk.fail()
+    scrape(checkpoint=checkpoint)
+    fake_vk.fail(False)
+    resumed = scrape(checkpoint=checkpoint)
+
+    assert resumed.complete
+    assert len(checkpoint.done_units()) == 6
+    assert post_keys(resumed) == post_keys(expected)
+    assert comment_ids(resumed) == comment_ids(expected)
+
+def test_resume_after_failed_comments(fake_vk, scrape, tmp_path):
+    expected = scrape()
+
+    checkpoint = CheckpointStore(str(tmp_path / "job.sqlite"))
+    fake_vk.fail('wall.getComments')
+    failed = scrape(checkpoint=checkpoint)
+    assert len(failed.unfinished_posts) == failed.post_count
+    assert failed.comment_count == 0
+    assert checkpoint.commented_keys() == set()
+
+    fake_vk.fail(False)
+    resumed = scrape(checkpoint=checkpoint)
+    assert resumed.complete
+    assert checkpoint.pending_comment_posts() == []
+    assert comment_ids(resumed) == comment_ids(expected)
+
+def test_adaptive_mode_keeps_cursor_on_failure(fake_vk, scrape, tmp_path):
+    expected = scrape(adaptive=True)
+
+    checkpoint = CheckpointStore(str(tmp_path / "job.sqlite"))
+    fake_vk.fail()
+    failed = scrape(checkpoint=checkpoint, adaptive=True)
+    assert {unit[0] for unit in failed.unfinished_units} == {"искусственный интеллект", "метро"}
+    assert checkpoint.done_units() == set()
+
+    fake_vk.fail(False)
+    resumed = scrape(checkpoint=checkpoint, adaptive=True)
+    assert resumed.complete
+    assert post_keys(resumed) == post_keys(expected)
@@ -0,0 +1,31 @@
+import glob
+import os
+
+import cli
+from conftest import QUERIES
+
+def run_cli(tmp_path, *extra):
+    tokens_path = tmp_path / "tokens.txt"
+    tokens_path.write_text("\n".join(f"token-{index}" for index in range(20)), encoding='utf-8')
+    argv = [
+        "--tokens-file", str(tokens_path), "--start", "2024-01-01T00:00", "--end", "2024-01-01T03:00",
+        "--output", str(tmp_path / "out"), "--comments", "--skip-validation",
+    ]
+    for query in QUERIES:
+        argv += ["--query", query]
+    cli.main(argv + list(extra))
+
+def test_incremental_run_leaves_no_checkpoint(fake_vk, tmp_path, capsys):
+    fake_vk.fail()
+    run_cli(tmp_path, "--incremental")
+    assert glob.glob(str(tmp_path / "out" / "**" / "checkpoint.sqlite"), recursive=True) == []
+    assert '"unfinished_units": 6' in capsys.readouterr().out
+
+def test_incomplete_run_keeps_checkpoint(fake_vk, tmp_path):
+    fake_vk.fail()
+    run_cli(tmp_path)
+    assert os.path.exists(tmp_path / "out" / "shard-0-of-1" / "checkpoint.sqlite")
+
+    fake_vk.fail(False)
+    run_cli(tmp_path, "--resume")
+    assert not os.path.exists(tmp_path / "out" / "shard-0-of-1" / "checkpoint.sqlite")
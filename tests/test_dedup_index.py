@@ -0,0 +1,31 @@
+import json
+
+from vk_scraper import DedupIndex
+
+def test_failed_comment_fetches_are_not_persisted(fake_vk, scrape, tmp_path):
+    index_path = str(tmp_path / "dedup_index.json")
+    fake_vk.fail('wall.getComments')
+    failed = scrape(dedup_index=DedupIndex(index_path))
+    failed.index.save()
+    with open(index_path, encoding='utf-8') as index_file:
+        assert json.load(index_file) == []
+
+    fake_vk.fail(False)
+    collected = scrape(dedup_index=DedupIndex(index_path))
+    collected.index.save()
+    assert collected.comment_count > 0
+    assert len(DedupIndex(index_path).collected) == collected.post_count
+
+    # Следующий запуск с тем же индексом комментарии к этим постам уже не запрашивает
+    repeated = scrape(dedup_index=DedupIndex(index_path))
+    assert repeated.post_count == collected.post_count
+    assert repeated.comment_count == 0
+
+def test_released_posts_can_be_claimed_again():
+    index = DedupIndex()
+    post = {'owner_id': -1, 'id': 10}
+    assert index.claim_comments([post]) == [post]
+    assert index.claim_comments([post]) == []
+    index.release_comments([post])
+    assert index.claim_comments([post]) == [post]
+    assert index.collected == set()
@@ -0,0 +1,20 @@
+import pytest
+
+from vk_scraper import ApiMetrics, TokenScheduler, call_vk_api_raw
+
+def test_network_errors_are_recorded(fake_vk):
+    metrics = ApiMetrics()
+    scheduler = TokenScheduler(["token"], metrics=metrics)
+    fake_vk.fail()
+    with pytest.raises(ConnectionError):
+        call_vk_api_raw('execute', {'code': 'return [API.wall.getComments({"post_id": 1})];'}, scheduler)
+
+    snapshot = metrics.snapshot()
+    assert snapshot['requests'] == 1
+    assert snapshot['error_codes'] == {'ConnectionError': 1}
+    assert snapshot['methods']['execute(wall.getComments)']['errors'] == 1
+    assert list(snapshot['tokens'].values())[0]['errors'] == 1
+
+    fake_vk.fail(False)
+    call_vk_api_raw('users.get', {}, scheduler)
+    assert metrics.snapshot()['requests'] == 2
@@ -0,0 +1,47 @@
+import datetime
+
+import vk_scraper
+from conftest import QUERIES, START
+from vk_scraper import MONITOR_OVERLAP, MonitorState, ResponseCache, get_unixtime_from_datetime
+
+def watermarks(monitor):
+    return dict(monitor.conn.execute("SELECT query, watermark FROM watermarks"))
+
+def test_watermark_keeps_overlap_before_latest_post(fake_vk, scrape, tmp_path):
+    monitor = MonitorState(str(tmp_path / "state.sqlite"))
+    results = scrape(hours=3, monitor=monitor)
+    posts, _ = results.read_frames()
+    range_end = get_unixtime_from_datetime(START + datetime.timedelta(hours=3))
+
+    # Посты найдены и в последний час, но отметка не заходит в перекрытие
+    assert posts['date'].max() > range_end - MONITOR_OVERLAP
+    assert watermarks(monitor) == {query: range_end - MONITOR_OVERLAP for query in QUERIES}
+
+def test_failed_windows_stay_behind_watermark(fake_vk, scrape, tmp_path):
+    expected = scrape(hours=4)
+    monitor = MonitorState(str(tmp_path / "state.sqlite"))
+    fake_vk.fail()
+    failed = scrape(hours=3, monitor=monitor)
+    assert not failed.complete
+    assert watermarks(monitor) == {query: get_unixtime_from_datetime(START) for query in QUERIES}
+
+    fake_vk.fail(False)
+    resumed = scrape(hours=4, monitor=monitor)
+    assert resumed.complete
+    assert resumed.post_count == expected.post_count
+
+def test_new_comments_are_fetched_with_response_cache(fake_vk, scrape, tmp_path, monkeypatch):
+    monkeypatch.setattr(vk_scraper, 'MONITOR_WATCH_PERIOD', 100 * 365 * 24 * 3600)
+    monitor = MonitorState(str(tmp_path / "state.sqlite"))
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    first = scrape(hours=3, monitor=monitor, response_cache=cache)
+    _, first_comments = first.read_frames()
+
+    comment_count = fake_vk.fake.comment_count
+    monkeypatch.setattr(fake_vk.fake, 'comment_count', lambda post_id: comment_count(post_id) + 2)
+    second = scrape(hours=3, monitor=monitor, response_cache=cache)
+    _, second_comments = second.read_frames()
+
+    assert second.post_count == 0
+    assert len(second_comments) == 2 * first.post_count
+    assert not set(second_comments['id']) & set(first_comments['id'])
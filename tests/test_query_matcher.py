@@ -0,0 +1,57 @@
+import random
+import re
+
+import pytest
+
+from matcher_benchmark import WORDS, make_corpus
+from vk_scraper import QueryMatcher, fold_text
+
+def reference_match(text, queries, search_mode):
+    """Отдельная проверка каждого запроса, как в фильтре до QueryMatcher."""
+    folded = fold_text(text)
+    matched = []
+    for query in queries:
+        pattern = fold_text(query.strip().strip('"«»').strip())
+        if not pattern:
+            continue
+        if search_mode == 'exact':
+            found = re.search(rf'(?<!\w){re.escape(pattern)}(?!\w)', folded)
+        else:
+            found = pattern in folded
+        if found:
+            matched.append(query)
+    return sorted(matched)
+
+QUERIES = [
+    "цены", "цены на нефть", "нефть", '"искусственный интеллект"', "«Нейросеть»", "нейро",
+    "метро", "метро москвы", "Учёные", "ученые", "сеть", "се",
+]
+
+@pytest.mark.parametrize('search_mode', ['exact', 'partial'])
+def test_matches_like_separate_searches(search_mode):
+    rng = random.Random(7)
+    corpus = make_corpus(300, rng) + [
+        "", "!", "...цены на нефть", "Цены на нефть растут", "ЦЕНЫ НА НЕФТЬ", "ценынанефть",
+        "учёные и ученые", "нейросеть-помощник", "интернет сеть", "искусственный интеллект.",
+        "метро москвы и метро", "метрополитен",
+    ]
+    corpus += [" ".join(rng.choices(WORDS + ["на", "москвы", "нейро"], k=10)) for _ in range(300)]
+    matcher = QueryMatcher(QUERIES, search_mode)
+    for text in corpus:
+        assert sorted(matcher.match(text)) == reference_match(text, QUERIES, search_mode), text
+
+@pytest.mark.parametrize('queries', [['""'], ['«»'], ['""', ' « » ']])
+@pytest.mark.parametrize('search_mode', ['exact', 'partial'])
+def test_queries_of_only_quotes_match_nothing(queries, search_mode):
+    matcher = QueryMatcher(queries, search_mode)
+    for text in ["", "!", " ", "Новости", "«»"]:
+        assert matcher.match(text) == []
+
+def test_quote_only_query_is_dropped_among_others():
+    matcher = QueryMatcher(['""', "метро"], 'exact')
+    assert matcher.match("") == []
+    assert matcher.match("!метро") == ["метро"]
+
+def test_duplicate_patterns_return_every_query():
+    matcher = QueryMatcher(["Метро", '"метро"', "метрО"], 'exact')
+    assert sorted(matcher.match("новое метро")) == sorted(["Метро", '"метро"', "метрО"])
@@ -0,0 +1,90 @@
+import vk_scraper
+from vk_scraper import RESPONSE_CACHE_TTL, ResponseCache, TokenScheduler, call_vk_api_batch
+
+class Clock:
+    def __init__(self):
+        self.now = 2_000_000_000.0
+
+    def __call__(self):
+        return self.now
+
+def search_call(end_time, query="метро"):
+    return 'newsfeed.search', {'q': query, 'count': 200, 'start_time': end_time - 3600, 'end_time': end_time}
+
+def comments_call(post_id):
+    return 'wall.getComments', {'owner_id': -1, 'post_id': post_id, 'count': 100, 'offset': 0}
+
+def test_ttl_by_method_and_window(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(vk_scraper.time, 'time', clock)
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    closed, live, comments = search_call(int(clock.now) - 7200), search_call(int(clock.now)), comments_call(1)
+    calls = [closed, live, comments]
+    cache.set_many(calls, [{'items': [1]}, {'items': [2]}, {'items': [3]}])
+    assert cache.get_many(calls) == [{'items': [1]}, {'items': [2]}, {'items': [3]}]
+
+    # Окно, которое ещё индексируется, устаревает первым, затем комментарии, закрытое окно живёт дольше всех
+    clock.now += vk_scraper.RESPONSE_CACHE_LIVE_TTL + 1
+    assert cache.get_many(calls) == [{'items': [1]}, None, {'items': [3]}]
+    clock.now += RESPONSE_CACHE_TTL['wall.getComments']
+    assert cache.get_many(calls) == [{'items': [1]}, None, None]
+    clock.now += RESPONSE_CACHE_TTL['newsfeed.search']
+    assert cache.get_many(calls) == [None, None, None]
+
+    # Воспроизведение записи отдаёт и устаревшие ответы
+    assert ResponseCache(str(tmp_path / "cache.sqlite"), offline=True).get_many(calls) == [{'items': [1]}, {'items': [2]}, {'items': [3]}]
+
+def test_failed_and_uncached_calls_are_not_stored(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    calls = [comments_call(1), comments_call(2), ('users.get', {})]
+    cache.set_many(calls, [None, {}, [{'id': 1}]])
+    assert cache.total_bytes == 0
+    assert cache.get_many(calls) == [None, None, None]
+
+def test_lru_eviction(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(vk_scraper.time, 'time', clock)
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    response = {'items': ["комментарий"] * 20}
+    first, second, third = comments_call(1), comments_call(2), comments_call(3)
+    cache.set_many([first], [response])
+    entry_size = cache.total_bytes
+    # Три записи не помещаются, а после вытеснения до 90% предела остаются две
+    cache.max_bytes = entry_size * 2.5
+
+    clock.now += 1
+    cache.set_many([second], [response])
+    # Первую запись читали позже второй, поэтому при переполнении вытесняется вторая
+    clock.now += 1
+    cache.get_many([first])
+    clock.now += 1
+    cache.set_many([third], [response])
+
+    assert cache.get_many([first, second, third]) == [response, None, response]
+    assert cache.total_bytes == entry_size * 2
+
+def test_uncached_call_bypasses_cache(fake_vk, tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    scheduler = TokenScheduler(["token"], response_cache=cache)
+    calls = [comments_call(1000)]
+
+    first = call_vk_api_batch(calls, scheduler)
+    fake_vk.fake.comment_count = lambda post_id: 50
+    assert call_vk_api_batch(calls, scheduler) == first
+    fresh = call_vk_api_batch(calls, scheduler, cached=False)
+    assert fresh[0]['count'] == 50
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    offline = ResponseCache(str(tmp_path / "cache.sqlite"), offline=True)
+    assert call_vk_api_batch(calls, TokenScheduler(["token"], response_cache=offline), cached=False) == [None]
+
+def test_size_limit_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    # Два соединения с одним файлом, как у процессов cli.py --processes
+    caches = [ResponseCache(path, max_bytes=20000), ResponseCache(path, max_bytes=20000)]
+    for post_id in range(200):
+        response = {'items': [f"комментарий {post_id} {index}" for index in range(30)]}
+        caches[post_id % 2].set_many([comments_call(post_id)], [response])
+
+    total = caches[0].conn.execute("SELECT SUM(size) FROM responses").fetchone()[0]
+    assert total <= 20000
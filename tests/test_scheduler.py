@@ -0,0 +1,45 @@
+from vk_scraper import TokenScheduler
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+def test_rate_window_starts_when_response_arrives(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('vk_scraper.time.monotonic', clock)
+    scheduler = TokenScheduler(["token-a"], rate_limit=3)
+
+    for _ in range(3):
+        assert scheduler.try_acquire()[0] == "token-a"
+    assert scheduler.try_acquire()[0] is None
+
+    # Ответы пришли через 0.5 секунды: лимит освобождается через секунду после них, а не после выдачи
+    clock.now += 0.5
+    for _ in range(3):
+        scheduler.release("token-a")
+    clock.now += 0.9
+    token, wait = scheduler.try_acquire()
+    assert token is None and wait > 0
+    clock.now += wait
+    assert scheduler.try_acquire()[0] == "token-a"
+
+def test_prefers_token_with_most_capacity(monkeypatch):
+    monkeypatch.setattr('vk_scraper.time.monotonic', Clock())
+    scheduler = TokenScheduler(["token-a", "token-b"], rate_limit=3)
+
+    tokens = [scheduler.try_acquire()[0] for _ in range(6)]
+    assert sorted(tokens) == ["token-a"] * 3 + ["token-b"] * 3
+    assert scheduler.try_acquire()[0] is None
+
+def test_rate_limit_error_blocks_token(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('vk_scraper.time.monotonic', clock)
+    scheduler = TokenScheduler(["token-a", "token-b"], rate_limit=3)
+
+    scheduler.report_error("token-a", 6)
+    assert {scheduler.try_acquire()[0] for _ in range(3)} == {"token-b"}
+    clock.now += 1.0
+    assert scheduler.try_acquire()[0] == "token-a"
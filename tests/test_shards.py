@@ -0,0 +1,27 @@
+from conftest import START
+
+from vk_scraper import build_time_units
+
+def post_keys(results):
+    posts, _ = results.read_frames()
+    return list(zip(posts['owner_id'], posts['id']))
+
+def test_window_queries_stay_in_one_shard():
+    queries = ["метро", "нефть", "цены"]
+    end = START.replace(day=3)
+    shards = [build_time_units(queries, START, end, 1, (index, 3)) for index in range(3)]
+
+    windows = [{unit[1] for unit in units} for units in shards]
+    assert sum(len(units) for units in shards) == len(build_time_units(queries, START, end, 1))
+    assert not windows[0] & windows[1] and not windows[1] & windows[2] and not windows[0] & windows[2]
+    for units in shards:
+        assert len(units) == len(queries) * len({unit[1] for unit in units})
+
+def test_shards_do_not_duplicate_posts(fake_vk, scrape):
+    whole = scrape()
+    shards = [scrape(shard=(index, 2)) for index in range(2)]
+
+    sharded_posts = post_keys(shards[0]) + post_keys(shards[1])
+    assert len(sharded_posts) == len(set(sharded_posts))
+    assert set(sharded_posts) == set(post_keys(whole))
+    assert sum(results.comment_count for results in shards) == whole.comment_count
@@ -0,0 +1,34 @@
+import pytest
+
+import vk_scraper
+from conftest import FakeResponse
+from vk_scraper import TokenStatusCache, validate_tokens
+
+class ErrorSession:
+    """users.get отвечает заданной ошибкой VK для каждого токена."""
+
+    def __init__(self, error_codes):
+        self.error_codes = error_codes
+
+    def get(self, url, params, timeout=None):
+        error_code = self.error_codes[params['access_token']]
+        if error_code is None:
+            return FakeResponse({'response': [{'id': 1}]})
+        return FakeResponse({'error': {'error_code': error_code, 'error_msg': 'ошибка'}})
+
+@pytest.mark.parametrize('error_code, status, valid', [
+    (None, 'valid', True),
+    (6, 'rate_limited', True),
+    (5, 'revoked', False),
+    (18, 'revoked', False),
+    (10, None, False),
+])
+def test_token_status_by_error(error_code, status, valid, tmp_path, monkeypatch):
+    monkeypatch.setattr(vk_scraper, 'http_session', ErrorSession({"token-a": error_code}))
+    cache = TokenStatusCache(str(tmp_path / "tokens.json"))
+
+    valid_tokens, invalid_tokens = validate_tokens(["token-a"], cache)
+    assert (valid_tokens == ["token-a"]) == valid
+    assert (invalid_tokens == ["token-a"]) != valid
+    # Временная ошибка VK не попадает в кэш, и следующая проверка снова спросит VK
+    assert cache.get("token-a") == status
@@ -0,0 +1,1868 @@
+"""Движок парсинга новостей и комментариев VK без зависимости от интерфейса."""
+import requests
+import pandas as pd
+import time
+import logging
+import datetime
+import re
+import json
+import math
+import threading
+import gzip
+import zlib
+import sqlite3
+import hashlib
+import bisect
+import os
+import asyncio
+import aiohttp
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+VK_API_URL = "https://api.vk.com/method"
+VK_API_VERSION = "5.131"
+
+# VK разрешает примерно 3 запроса в секунду на один токен
+TOKEN_RATE_LIMIT = 3
+
+# Коды ошибок VK, после которых токен нужно притормозить:
+# 6 - слишком много запросов в секунду, 9 - flood control, 29 - достигнут лимит метода
+RATE_LIMIT_BACKOFF = {6: 1.0, 9: 30.0, 29: 3600.0}
+MAX_API_RETRIES = 5
+API_REQUEST_TIMEOUT = 60
+
+# Ошибки, после которых токен выводится из ротации до конца парсинга:
+# 5 - авторизация не удалась (токен отозван), 17 - нужна валидация, 18 - страница удалена или заблокирована
+TOKEN_FATAL_ERRORS = (5, 17, 18)
+
+# Проверка токенов: параллельность, таймаут запроса (секунды), файл кэша и срок жизни статусов
+TOKEN_VALIDATION_WORKERS = 20
+TOKEN_VALIDATION_TIMEOUT = 10
+TOKEN_CACHE_PATH = "token_cache.json"
+TOKEN_STATUS_TTL = {'valid': 6 * 3600, 'rate_limited': 15 * 60, 'revoked': 24 * 3600}
+
+NEWSFEED_PAGE_SIZE = 200
+# newsfeed.search отдаёт не больше 1000 постов на запрос (5 страниц по next_from)
+NEWSFEED_MAX_PAGES = 5
+
+# wall.getComments: размер страницы, сколько ответов ветки приходит вместе с комментарием
+# и сколько запросов по умолчанию можно потратить на один пост
+COMMENTS_PAGE_SIZE = 100
+COMMENTS_THREAD_ITEMS = 10
+COMMENTS_MAX_PAGES = 5
+
+# Адаптивный режим: границы ширины окна (секунды), порог "редкого" окна
+# и сколько последних окон каждого запроса показывать в прогрессе
+ADAPTIVE_MIN_WINDOW = 60
+ADAPTIVE_MAX_WINDOW = 7 * 24 * 3600
+ADAPTIVE_SPARSE_ITEMS = NEWSFEED_PAGE_SIZE // 4
+ADAPTIVE_TREE_LINES = 5
+
+# execute позволяет выполнить до 25 вызовов API за один запрос
+EXECUTE_BATCH_SIZE = 25
+
+# Асинхронный движок: запросов в полёте, соединений в пуле, таймаут запроса (секунды)
+ASYNC_CONCURRENCY = 200
+ASYNC_CONNECTIONS = 8
+ASYNC_REQUEST_TIMEOUT = 60
+
+# Кэш ответов VK API: файл, предел размера (байты) и срок жизни по методам (секунды).
+# Окно поиска считается закрытым через RESPONSE_CACHE_SETTLE после своего конца (поиск
+# индексирует с задержкой), а окна, которые ещё не закрылись, живут RESPONSE_CACHE_LIVE_TTL.
+# Проверка новых комментариев в инкрементальном режиме идёт мимо кэша
+RESPONSE_CACHE_PATH = "response_cache.sqlite"
+RESPONSE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+RESPONSE_CACHE_TTL = {'newsfeed.search': 30 * 24 * 3600, 'wall.getComments': 3600}
+RESPONSE_CACHE_LIVE_TTL = 300
+RESPONSE_CACHE_SETTLE = 3600
+
+# Метрики запросов: границы корзин гистограммы задержек (секунды) и окно (секунды),
+# по скорости в котором прогнозируется оставшееся время
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ETA_WINDOW = 60
+
+# Каталог для файлов контрольных точек прерванных парсингов
+CHECKPOINT_DIR = "checkpoints"
+# Сколько раз за запуск браться за окно или пост, запрос по которым не удался;
+# после этого они остаются незавершёнными до следующего запуска
+UNIT_RETRIES = 3
+
+# Инкрементальный режим: файл состояния между запусками, перекрытие окон на задержку
+# индексации поиска VK и срок, в течение которого у постов отслеживаются новые комментарии
+MONITOR_STATE_PATH = "monitor_state.sqlite"
+MONITOR_OVERLAP = 3600
+MONITOR_WATCH_PERIOD = 7 * 24 * 3600
+WALL_GET_BY_ID_SIZE = 100
+
+# Потоковая запись результатов: каталог запусков и размер группы строк Parquet
+RESULTS_DIR = "results"
+RESULT_CHUNK_SIZE = 5000
+
+# Плоская типизированная схема результатов; счётчики вовлечённости - целые колонки *_count
+ENGAGEMENT_COUNTERS = ('likes', 'reposts', 'views', 'comments')
+POST_COLUMNS = ('text', 'date', 'id', 'owner_id', 'from_id', 'post_type')
+POST_SCHEMA = pa.schema([
+    ('matched_query', pa.list_(pa.string())),
+    ('text', pa.string()),
+    ('date', pa.int64()),
+    ('id', pa.int64()),
+    ('owner_id', pa.int64()),
+    ('from_id', pa.int64()),
+    ('post_type', pa.string()),
+    ('likes_count', pa.int64()),
+    ('reposts_count', pa.int64()),
+    ('views_count', pa.int64()),
+    ('comments_count', pa.int64()),
+    ('attachments', pa.string()),
+    ('extra', pa.string()),
+])
+# Пока идёт парсинг, посты пишутся без matched_query: список запросов известен только в конце
+PARTIAL_POST_SCHEMA = POST_SCHEMA.remove(POST_SCHEMA.get_field_index('matched_query'))
+COMMENT_COLUMNS = ('id', 'from_id', 'date', 'text', 'post_id', 'post_owner_id', 'owner_id', 'reply_to_user', 'reply_to_comment')
+COMMENT_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('from_id', pa.int64()),
+    ('date', pa.int64()),
+    ('text', pa.string()),
+    ('post_id', pa.int64()),
+    ('post_owner_id', pa.int64()),
+    ('owner_id', pa.int64()),
+    ('reply_to_user', pa.int64()),
+    ('reply_to_comment', pa.int64()),
+    ('likes_count', pa.int64()),
+    ('parents_stack', pa.string()),
+    ('attachments', pa.string()),
+])
+
+# Индекс постов, комментарии к которым уже собраны в прошлых запусках
+DEDUP_INDEX_PATH = os.path.join(RESULTS_DIR, "dedup_index.json")
+
+# Общая сессия с keep-alive, чтобы не открывать TCP/TLS соединение на каждый запрос
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=100))
+
+def get_unixtime_from_datetime(dt):
+    return int(time.mktime(dt.timetuple()))
+
+def mask_token(token):
+    return f"{token[:6]}...{token[-4:]}" if len(token) > 10 else token
+
+class VKApiError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"[{code}] {message}")
+        self.code = code
+
+class TokenStatusCache:
+    """JSON-файл со статусами токенов (valid, rate_limited, revoked) и временем проверки.
+
+    Токены хранятся в виде sha256, статус считается актуальным в течение TOKEN_STATUS_TTL.
+    """
+
+    def __init__(self, path=TOKEN_CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as cache_file:
+                self.entries = json.load(cache_file)
+
+    @staticmethod
+    def token_key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        with self.lock:
+            entry = self.entries.get(self.token_key(token))
+        if entry and time.time() - entry['checked_at'] < TOKEN_STATUS_TTL[entry['status']]:
+            return entry['status']
+        return None
+
+    def set(self, token, status):
+        with self.lock:
+            self.entries[self.token_key(token)] = {'status': status, 'checked_at': time.time()}
+            if self.path:
+                with open(self.path, 'w', encoding='utf-8') as cache_file:
+                    json.dump(self.entries, cache_file)
+
+class LatencyHistogram:
+    """Гистограмма задержек с корзинами LATENCY_BUCKETS, счётчиками ошибок и полученных байт."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes_received = 0
+
+    def add(self, seconds, size, error):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.errors += bool(error)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.bytes_received += size
+
+    def quantile(self, fraction):
+        # Оценка сверху: граница корзины, в которую попадает квантиль
+        threshold = fraction * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (self.max_seconds,), self.buckets):
+            seen += count
+            if seen >= threshold:
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+
+    def summary(self):
+        return {
+            'requests': self.count,
+            'errors': self.errors,
+            'mean_ms': round(self.total_seconds / self.count * 1000, 1) if self.count else 0.0,
+            'p50_ms': round(self.quantile(0.5) * 1000, 1),
+            'p95_ms': round(self.quantile(0.95) * 1000, 1),
+            'max_ms': round(self.max_seconds * 1000, 1),
+            'bytes_received': self.bytes_received,
+            'histogram': dict(zip([f"<={bound}s" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"], self.buckets)),
+        }
+
+class ApiMetrics:
+    """Метрики всех HTTP-запросов к VK API за один парсинг.
+
+    Задержки собираются гистограммами по методу (пакеты execute подписываются вызываемыми
+    в них методами) и по токену, отдельно считаются коды ошибок, повторы, полученные байты
+    и суммарное время ожидания свободного токена по всем потокам.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.methods = defaultdict(LatencyHistogram)
+        self.tokens = defaultdict(LatencyHistogram)
+        self.error_codes = Counter()
+        self.retries = 0
+        self.token_wait_seconds = 0.0
+
+    @staticmethod
+    def request_label(method, params):
+        if method != 'execute':
+            return method
+        methods = sorted(set(re.findall(r'API\.([\w.]+)\(', params['code'])))
+        return f"execute({', '.join(methods)})"
+
+    def record_request(self, label, token, seconds, size, error_code=None):
+        """error_code - код ошибки VK или имя класса исключения, если ответ не получен."""
+        with self.lock:
+            self.methods[label].add(seconds, size, error_code)
+            self.tokens[mask_token(token)].add(seconds, size, error_code)
+            if error_code is not None:
+                self.error_codes[error_code] += 1
+
+    def record_errors(self, codes):
+        # Ошибки вызовов внутри execute: запрос успешен, но отдельные вызовы не выполнились
+        with self.lock:
+            self.error_codes.update(codes)
+
+    def record_retries(self, count=1):
+        with self.lock:
+            self.retries += count
+
+    def record_wait(self, seconds):
+        with self.lock:
+            self.token_wait_seconds += seconds
+
+    def snapshot(self):
+        with self.lock:
+            methods = {label: histogram.summary() for label, histogram in self.methods.items()}
+            tokens = {token: histogram.summary() for token, histogram in self.tokens.items()}
+            elapsed = time.time() - self.started
+            requests_made = sum(histogram.count for histogram in self.methods.values())
+            return {
+                'elapsed_seconds': round(elapsed, 1),
+                'requests': requests_made,
+                'requests_per_second': round(requests_made / elapsed, 2) if elapsed else 0.0,
+                'bytes_received': sum(histogram.bytes_received for histogram in self.methods.values()),
+                'retries': self.retries,
+                'token_wait_seconds': round(self.token_wait_seconds, 1),
+                'error_codes': {str(code): count for code, count in self.error_codes.most_common()},
+                'methods': methods,
+                'tokens': tokens,
+            }
+
+    def save(self, path):
+        # Запись через временный файл, чтобы читатель никогда не увидел половину JSON
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as metrics_file:
+            json.dump(self.snapshot(), metrics_file, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+
+class EtaEstimator:
+    """Прогноз оставшегося времени по скорости выполнения единиц работы за последние ETA_WINDOW секунд."""
+
+    def __init__(self, window=ETA_WINDOW):
+        self.window = window
+        self.points = deque()
+
+    def update(self, done, total):
+        now = time.monotonic()
+        self.points.append((now, done))
+        while len(self.points) > 2 and now - self.points[1][0] >= self.window:
+            self.points.popleft()
+        first_time, first_done = self.points[0]
+        if done <= first_done or now <= first_time:
+            return None
+        return (total - done) / ((done - first_done) / (now - first_time))
+
+def format_eta(eta):
+    return "оценивается..." if eta is None else f"{eta/60:.1f} мин"
+
+class TokenScheduler:
+    """Выдаёт токен с наибольшим остатком лимита и учитывает ошибки VK по каждому токену.
+
+    Вызов занимает слот лимита с выдачи токена, а секундное окно отсчитывается от release(),
+    то есть от получения ответа: VK считает лимит по приходу запроса, и задержка сети
+    не должна сдвигать следующий запрос токена внутрь этого окна.
+    Токены с ошибками из TOKEN_FATAL_ERRORS помечаются нерабочими и больше не выдаются.
+    """
+
+    def __init__(self, tokens, stats=None, rate_limit=TOKEN_RATE_LIMIT, cache=None, response_cache=None, metrics=None):
+        self.rate_limit = rate_limit
+        self.cache = cache
+        self.response_cache = response_cache
+        self.metrics = metrics if metrics is not None else ApiMetrics()
+        self.lock = threading.Lock()
+        self.calls = {token: deque() for token in tokens}
+        self.in_flight = {token: 0 for token in tokens}
+        self.blocked_until = {token: 0.0 for token in tokens}
+        self.failures = {token: 0 for token in tokens}
+        self.unhealthy = set()
+        self.stats = stats if stats is not None else {}
+        for token in tokens:
+            self.stats.setdefault(mask_token(token), {'requests': 0, 'errors': 0, 'rate_limited': 0})
+            self.stats[mask_token(token)]['status'] = 'ok'
+
+    def try_acquire(self):
+        """Возвращает (токен, 0) или (None, сколько секунд подождать)."""
+        with self.lock:
+            now = time.monotonic()
+            best_token, best_capacity, wait = None, 0, 1.0
+            if len(self.unhealthy) == len(self.calls):
+                raise VKApiError(5, "не осталось рабочих токенов")
+            for token, calls in self.calls.items():
+                if token in self.unhealthy:
+                    continue
+                # Окно в одну секунду: старые вызовы больше не занимают лимит
+                while calls and now - calls[0] >= 1.0:
+                    calls.popleft()
+                if self.blocked_until[token] > now:
+                    wait = min(wait, self.blocked_until[token] - now)
+                    continue
+                capacity = self.rate_limit - len(calls) - self.in_flight[token]
+                if capacity > best_capacity:
+                    best_token, best_capacity = token, capacity
+                elif capacity <= 0 and calls:
+                    wait = min(wait, 1.0 - (now - calls[0]))
+
+            if best_token is None:
+                return None, max(wait, 0.01)
+            self.in_flight[best_token] += 1
+            self.stats[mask_token(best_token)]['requests'] += 1
+            return best_token, 0
+
+    def release(self, token):
+        """Ответ на запрос с токеном получен (или запрос не удался): с этого момента идёт его секунда."""
+        with self.lock:
+            self.in_flight[token] -= 1
+            self.calls[token].append(time.monotonic())
+
+    def acquire(self):
+        while True:
+            token, wait = self.try_acquire()
+            if token is not None:
+                return token
+            self.metrics.record_wait(wait)
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while True:
+            token, wait = self.try_acquire()
+            if token is not None:
+                return token
+            self.metrics.record_wait(wait)
+            await asyncio.sleep(wait)
+
+    def report_success(self, token):
+        with self.lock:
+            self.failures[token] = 0
+
+    def report_error(self, token, code):
+        with self.lock:
+            token_stats = self.stats[mask_token(token)]
+            token_stats['errors'] += 1
+            if code in RATE_LIMIT_BACKOFF:
+                token_stats['rate_limited'] += 1
+                # Экспоненциальная пауза при повторных ошибках одного и того же токена
+                self.failures[token] += 1
+                backoff = RATE_LIMIT_BACKOFF[code] * 2 ** (self.failures[token] - 1)
+                self.blocked_until[token] = time.monotonic() + backoff
+            elif code in TOKEN_FATAL_ERRORS:
+                self.unhealthy.add(token)
+                token_stats['status'] = 'unhealthy'
+
+        if self.cache and code in TOKEN_FATAL_ERRORS:
+            self.cache.set(token, 'revoked')
+        elif self.cache and code == 29:
+            self.cache.set(token, 'rate_limited')
+
+class ResponseCache:
+    """SQLite-кэш ответов VK API по методу и параметрам запроса (без access_token).
+
+    Ответы хранятся сжатыми zlib, срок жизни задаётся по методу в RESPONSE_CACHE_TTL,
+    а при превышении max_bytes вытесняются давно не использованные записи.
+    В режиме offline сеть не используется: отдаются все записи, даже устаревшие,
+    а промахи возвращаются как неудавшиеся вызовы - так записанный парсинг можно
+    воспроизвести без токенов и сети.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_bytes=RESPONSE_CACHE_MAX_BYTES, offline=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Файл может быть общим для нескольких процессов CLI, поэтому ждём блокировку дольше обычного
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, method TEXT, expires_at REAL, accessed_at REAL, size INTEGER, data BLOB
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+        """)
+        self.total_bytes = self.conn.execute("SELECT IFNULL(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def request_key(method, params):
+        params = {key: value for key, value in params.items() if key not in ('access_token', 'v')}
+        return hashlib.sha1(json.dumps([method, params], sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def ttl(method, params):
+        """Срок жизни ответа или None, если метод не кэшируется."""
+        if method not in RESPONSE_CACHE_TTL:
+            return None
+        if 'end_time' in params and params['end_time'] > time.time() - RESPONSE_CACHE_SETTLE:
+            return RESPONSE_CACHE_LIVE_TTL
+        return RESPONSE_CACHE_TTL[method]
+
+    def get_many(self, calls):
+        """Ответы из кэша для списка (method, params); None - нет или устарел."""
+        results = [None] * len(calls)
+        keys = {}
+        for index, (method, params) in enumerate(calls):
+            if self.ttl(method, params) is not None:
+                keys.setdefault(self.request_key(method, params), []).append(index)
+        if not keys:
+            return results
+
+        now = time.time()
+        with self.lock, self.conn:
+            found = []
+            for key, indexes in keys.items():
+                row = self.conn.execute("SELECT expires_at, data FROM responses WHERE key = ?", (key,)).fetchone()
+                if row and (self.offline or row[0] > now):
+                    response = json.loads(zlib.decompress(row[1]))
+                    for index in indexes:
+                        results[index] = response
+                    found.append((now, key))
+                    self.hits += len(indexes)
+                else:
+                    self.misses += len(indexes)
+            self.conn.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?", found)
+        return results
+
+    def set_many(self, calls, responses):
+        now = time.time()
+        rows = []
+        for (method, params), response in zip(calls, responses):
+            ttl = self.ttl(method, params)
+            # Неудавшиеся вызовы и пустые ответы на постоянные ошибки не кэшируются
+            if ttl is None or not response:
+                continue
+            data = zlib.compress(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+            rows.append((self.request_key(method, params), method, now + ttl, now, len(data), data))
+        if not rows:
+            return
+
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", rows)
+            # Файл общий для процессов CLI, поэтому размер считается по таблице: после вставки
+            # транзакция держит блокировку записи, и чужие вставки в эту сумму не вклиниваются
+            self.total_bytes = self.conn.execute("SELECT IFNULL(SUM(size), 0) FROM responses").fetchone()[0]
+            if self.total_bytes > self.max_bytes:
+                self._evict(now)
+
+    def _evict(self, now):
+        # Сначала удаляются устаревшие записи, затем давно не использованные, пока размер не станет 90% предела
+        self.conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        self.total_bytes = self.conn.execute("SELECT IFNULL(SUM(size), 0) FROM responses").fetchone()[0]
+        target = self.max_bytes * 0.9
+        cursor = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at")
+        evicted = []
+        for key, size in cursor:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def close(self):
+        self.conn.close()
+
+def check_vk_response(json_text, access_token, scheduler):
+    """True - ответ успешный, False - токен упёрся в лимит или выбыл и запрос стоит повторить."""
+    if 'error' not in json_text:
+        scheduler.report_success(access_token)
+        return True
+
+    error = json_text['error']
+    scheduler.report_error(access_token, error.get('error_code'))
+    if error.get('error_code') not in RATE_LIMIT_BACKOFF and error.get('error_code') not in TOKEN_FATAL_ERRORS:
+        raise VKApiError(error.get('error_code'), error.get('error_msg', ''))
+    scheduler.metrics.record_retries()
+    return False
+
+def call_vk_api_raw(method, params, scheduler):
+    for attempt in range(MAX_API_RETRIES):
+        access_token = scheduler.acquire()
+        started = time.perf_counter()
+        try:
+            # POST, чтобы длинный код execute не упирался в ограничение длины URL
+            res = http_session.post(
+                f"{VK_API_URL}/{method}",
+                data={**params, 'access_token': access_token, 'v': VK_API_VERSION},
+                timeout=API_REQUEST_TIMEOUT
+            )
+            json_text = res.json()
+        except Exception as e:
+            # Сетевые ошибки и ответы не в JSON тоже попадают в метрики, с классом исключения вместо кода VK
+            scheduler.metrics.record_request(
+                ApiMetrics.request_label(method, params), access_token, time.perf_counter() - started, 0, type(e).__name__
+            )
+            raise
+        finally:
+            scheduler.release(access_token)
+        scheduler.metrics.record_request(
+            ApiMetrics.request_label(method, params), access_token, time.perf_counter() - started,
+            len(res.content), json_text.get('error', {}).get('error_code')
+        )
+        if check_vk_response(json_text, access_token, scheduler):
+            return json_text
+
+    error = json_text['error']
+    raise VKApiError(error.get('error_code'), error.get('error_msg', ''))
+
+def call_vk_api(method, params, scheduler):
+    return call_vk_api_raw(method, params, scheduler).get('response', {})
+
+def build_execute_code(calls):
+    api_calls = ",".join(
+        f"API.{method}({json.dumps(params, ensure_ascii=False)})" for method, params in calls
+    )
+    return f"return [{api_calls}];"
+
+def merge_execute_response(chunk, json_text, results, retry, metrics=None):
+    responses = json_text.get('response') or [False] * len(chunk)
+    errors = iter(json_text.get('execute_errors', []))
+    if metrics:
+        metrics.record_errors(error.get('error_code') for error in json_text.get('execute_errors', []))
+
+    for index, response in zip(chunk, responses):
+        if response is not False:
+            results[index] = response
+            continue
+        # Ошибки вложенных вызовов идут в execute_errors в том же порядке. Вызов без описания
+        # ошибки и упёршийся в лимит повторяется, а постоянная ошибка (например, закрытые
+        # комментарии) - это пустой ответ {}, в отличие от None у неудавшегося вызова
+        error = next(errors, None)
+        if error is None or error.get('error_code') in RATE_LIMIT_BACKOFF:
+            retry.append(index)
+        else:
+            results[index] = {}
+
+def call_vk_api_batch(calls, scheduler, cached=True):
+    """Выполняет список (method, params) через execute, по EXECUTE_BATCH_SIZE вызовов за запрос.
+
+    scheduler - TokenScheduler либо AsyncVKEngine (тогда все пакеты уходят параллельно).
+    Возвращает ответы в том же порядке, что и calls; для неудавшихся вызовов (сетевая ошибка
+    пакета или исчерпанные повторы) - None, для вызовов с постоянной ошибкой VK - {}.
+    Если у планировщика есть response_cache, в сеть уходят только вызовы без ответа в кэше;
+    cached=False - кэш не читается и не пополняется (в режиме offline такие вызовы не удаются).
+    """
+    token_scheduler = scheduler.scheduler if isinstance(scheduler, AsyncVKEngine) else scheduler
+    cache = token_scheduler.response_cache
+    if cache is not None and not cached and cache.offline:
+        return [None] * len(calls)
+    if cache is None or not cached:
+        return call_vk_api_batch_uncached(calls, scheduler)
+
+    results = cache.get_many(calls)
+    missing = [index for index, response in enumerate(results) if response is None]
+    if missing and not cache.offline:
+        missing_calls = [calls[index] for index in missing]
+        responses = call_vk_api_batch_uncached(missing_calls, scheduler)
+        cache.set_many(missing_calls, responses)
+        for index, response in zip(missing, responses):
+            results[index] = response
+    return results
+
+def call_vk_api_batch_uncached(calls, scheduler):
+    if isinstance(scheduler, AsyncVKEngine):
+        return scheduler.call_batch(calls)
+
+    results = [None] * len(calls)
+    pending = list(range(len(calls)))
+
+    for attempt in range(MAX_API_RETRIES):
+        retry = []
+        for chunk_start in range(0, len(pending), EXECUTE_BATCH_SIZE):
+            chunk = pending[chunk_start:chunk_start + EXECUTE_BATCH_SIZE]
+            try:
+                json_text = call_vk_api_raw('execute', {'code': build_execute_code([calls[i] for i in chunk])}, scheduler)
+            except Exception as e:
+                # Ответы остальных пакетов сохраняются, вызовы этого остаются неудавшимися
+                logger.error(f"Ошибка при выполнении пакета execute: {e}")
+                continue
+            merge_execute_response(chunk, json_text, results, retry, scheduler.metrics)
+
+        if not retry:
+            break
+        scheduler.metrics.record_retries(len(retry))
+        pending = retry
+
+    return results
+
+class AsyncVKEngine:
+    """Асинхронный клиент VK API на aiohttp с общим пулом keep-alive соединений.
+
+    Работает в собственном цикле событий в фоновом потоке, поэтому его можно
+    вызывать из обычного кода и из потоков вместо TokenScheduler. Одновременно
+    в полёте не больше concurrency запросов поверх connections соединений.
+    """
+
+    def __init__(self, scheduler, concurrency=ASYNC_CONCURRENCY, connections=ASYNC_CONNECTIONS, api_url=None):
+        self.scheduler = scheduler
+        self.concurrency = concurrency
+        self.connections = connections
+        # Адрес берётся при создании, чтобы подмена VK_API_URL (например, в бенчмарке) действовала на оба движка
+        self.api_url = api_url or VK_API_URL
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.session = self.run(self._open())
+
+    async def _open(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.connections, keepalive_timeout=60)
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=ASYNC_REQUEST_TIMEOUT))
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def call_batch(self, calls):
+        return self.run(self._call_batch(calls))
+
+    async def _call_raw(self, method, params):
+        for attempt in range(MAX_API_RETRIES):
+            async with self.semaphore:
+                access_token = await self.scheduler.acquire_async()
+                started = time.perf_counter()
+                try:
+                    async with self.session.post(
+                        f"{self.api_url}/{method}",
+                        data={**params, 'access_token': access_token, 'v': VK_API_VERSION}
+                    ) as res:
+                        body = await res.read()
+                    json_text = json.loads(body)
+                except Exception as e:
+                    self.scheduler.metrics.record_request(
+                        ApiMetrics.request_label(method, params), access_token, time.perf_counter() - started, 0, type(e).__name__
+                    )
+                    raise
+                finally:
+                    self.scheduler.release(access_token)
+                self.scheduler.metrics.record_request(
+                    ApiMetrics.request_label(method, params), access_token, time.perf_counter() - started,
+                    len(body), json_text.get('error', {}).get('error_code')
+                )
+            if check_vk_response(json_text, access_token, self.scheduler):
+                return json_text
+
+        error = json_text['error']
+        raise VKApiError(error.get('error_code'), error.get('error_msg', ''))
+
+    async def _call_batch(self, calls):
+        results = [None] * len(calls)
+        pending = list(range(len(calls)))
+
+        for attempt in range(MAX_API_RETRIES):
+            retry = []
+            chunks = [pending[i:i + EXECUTE_BATCH_SIZE] for i in range(0, len(pending), EXECUTE_BATCH_SIZE)]
+            responses = await asyncio.gather(*(
+                self._call_raw('execute', {'code': build_execute_code([calls[i] for i in chunk])})
+                for chunk in chunks
+            ), return_exceptions=True)
+            for chunk, json_text in zip(chunks, responses):
+                if isinstance(json_text, Exception):
+                    # Ответы остальных пакетов сохраняются, вызовы этого остаются неудавшимися
+                    logger.error(f"Ошибка при выполнении пакета execute: {json_text}")
+                    continue
+                merge_execute_response(chunk, json_text, results, retry, self.scheduler.metrics)
+
+            if not retry:
+                break
+            self.scheduler.metrics.record_retries(len(retry))
+            pending = retry
+
+        return results
+
+def tag_comment(comment, post):
+    comment['post_id'] = post['id']
+    comment['post_owner_id'] = post['owner_id']
+    return comment
+
+def iter_comments(posts, scheduler, max_pages=COMMENTS_MAX_PAGES, expand_threads=False, since_ids=None, failed=None, cached=True):
+    """Генератор комментариев: отдаёт их постранично (count=100) для всех постов сразу.
+
+    Каждая страница для всех постов и веток - один пакет execute. На один пост
+    (вместе с его ветками) тратится не больше max_pages запросов.
+    since_ids - {(owner_id, post_id): id последнего собранного комментария}: такие посты
+    листаются от новых к старым до первого уже известного комментария.
+    failed - множество, в которое добавляются (owner_id, post_id) постов с неудавшимся запросом.
+    cached=False - страницы запрашиваются мимо кэша ответов.
+    """
+    since_ids = since_ids or {}
+    failed = failed if failed is not None else set()
+    pages_used = {}
+    # Задание: (пост, комментарий-родитель ветки или None, смещение)
+    tasks = []
+    for post in posts:
+        pages_used[(post['owner_id'], post['id'])] = 1
+        tasks.append((post, None, 0))
+
+    while tasks:
+        calls = []
+        for post, thread_id, offset in tasks:
+            params = {'owner_id': post['owner_id'], 'post_id': post['id'], 'count': COMMENTS_PAGE_SIZE, 'offset': offset}
+            if thread_id is not None:
+                params['comment_id'] = thread_id
+            else:
+                if expand_threads:
+                    params['thread_items_count'] = COMMENTS_THREAD_ITEMS
+                if (post['owner_id'], post['id']) in since_ids:
+                    params['sort'] = 'desc'
+            calls.append(('wall.getComments', params))
+
+        try:
+            responses = call_vk_api_batch(calls, scheduler, cached)
+        except Exception as e:
+            logger.error(f"Ошибка при получении комментариев: {e}")
+            failed.update((post['owner_id'], post['id']) for post, _, _ in tasks)
+            return
+
+        page = []
+        next_tasks = []
+
+        def schedule(post, thread_id, offset):
+            key = (post['owner_id'], post['id'])
+            if pages_used[key] < max_pages:
+                pages_used[key] += 1
+                next_tasks.append((post, thread_id, offset))
+
+        for (post, thread_id, offset), response in zip(tasks, responses):
+            if response is None:
+                failed.add((post['owner_id'], post['id']))
+                continue
+            items = response.get('items', [])
+            since_id = since_ids.get((post['owner_id'], post['id'])) if thread_id is None else None
+            reached_known = False
+            for comment in items:
+                if since_id is not None and comment['id'] <= since_id:
+                    reached_known = True
+                    break
+                page.append(tag_comment(comment, post))
+                thread = comment.pop('thread', None) or {}
+                if not expand_threads:
+                    continue
+                thread_items = thread.get('items', [])
+                page.extend(tag_comment(reply, post) for reply in thread_items)
+                if thread.get('count', 0) > len(thread_items):
+                    schedule(post, comment['id'], len(thread_items))
+
+            level_count = response.get('current_level_count', response.get('count', 0))
+            if items and not reached_known and offset + len(items) < level_count:
+                schedule(post, thread_id, offset + len(items))
+
+        yield page
+        # Оставшиеся страницы поста, по которому запрос уже не удался, не запрашиваются
+        tasks = [task for task in next_tasks if (task[0]['owner_id'], task[0]['id']) not in failed]
+
+def get_comments(posts, scheduler, max_pages=COMMENTS_MAX_PAGES, expand_threads=False, since_ids=None, cached=True):
+    """Возвращает (комментарии, посты, комментарии к которым собрать не удалось).
+
+    Комментарии неудавшихся постов отбрасываются: такой пост потом собирается заново целиком.
+    """
+    failed = set()
+    comments = []
+    for page in iter_comments(posts, scheduler, max_pages, expand_threads, since_ids, failed, cached):
+        comments.extend(page)
+    if failed:
+        logger.warning(f"Не удалось собрать комментарии к {len(failed)} постам")
+        comments = [comment for comment in comments if (comment['post_owner_id'], comment['post_id']) not in failed]
+    return comments, [post for post in posts if (post['owner_id'], post['id']) in failed]
+
+def get_posts_by_id(keys, scheduler):
+    """Текущие версии постов по списку (owner_id, post_id): wall.getById по 100 постов в вызове, мимо кэша."""
+    calls = [
+        ('wall.getById', {'posts': ",".join(f"{owner_id}_{post_id}" for owner_id, post_id in keys[i:i + WALL_GET_BY_ID_SIZE])})
+        for i in range(0, len(keys), WALL_GET_BY_ID_SIZE)
+    ]
+    try:
+        responses = call_vk_api_batch(calls, scheduler, cached=False)
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении постов: {e}")
+        return []
+
+    posts = []
+    for response in responses:
+        if isinstance(response, dict):
+            response = response.get('items', [])
+        posts.extend(response or [])
+    return posts
+
+def refresh_comments(monitor, scheduler, results, comment_pages=COMMENTS_MAX_PAGES, expand_threads=False):
+    """Дособирает новые комментарии к отслеживаемым постам, у которых изменилось их число.
+
+    Запросы идут мимо кэша ответов: параметры страниц одинаковы от запуска к запуску,
+    и ответ из кэша скрыл бы комментарии, появившиеся после прошлой проверки.
+    Возвращает число постов, к которым пришлось обращаться за комментариями.
+    """
+    watched = monitor.watched_posts(time.time() - MONITOR_WATCH_PERIOD)
+    if not watched:
+        return 0
+
+    changed = [
+        post for post in get_posts_by_id(list(watched), scheduler)
+        if (post.get('comments') or {}).get('count', 0) != watched[(post['owner_id'], post['id'])][0]
+    ]
+    if changed:
+        since_ids = {key: last_comment_id for key, (_, last_comment_id) in watched.items() if last_comment_id is not None}
+        comments, failed_posts = get_comments(changed, scheduler, comment_pages, expand_threads, since_ids, cached=False)
+        results.add_comments(comments)
+        # У неудавшихся постов число не обновляется, и следующий запуск запросит их снова
+        failed_keys = {(post['owner_id'], post['id']) for post in failed_posts}
+        monitor.save_comment_counts([post for post in changed if (post['owner_id'], post['id']) not in failed_keys])
+    return len(changed)
+
+def fold_text(text):
+    # Регистр сворачивается через casefold, а «ё» приравнивается к «е», как в поиске VK
+    return text.casefold().replace('ё', 'е')
+
+def build_trie_pattern(patterns):
+    """Регулярное выражение-дерево: общие начала запросов проверяются один раз."""
+    trie = {}
+    for pattern in patterns:
+        node = trie
+        for char in pattern:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def render(node):
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Жадный "?" сначала пробует более длинный запрос, затем откатывается к короткому
+        return f'(?:{body})?' if '' in node else body
+
+    return render(trie)
+
+class QueryMatcher:
+    """Все запросы, скомпилированные в одно регулярное выражение.
+
+    match() за один проход по тексту возвращает все совпавшие запросы. В режиме
+    'exact' запрос должен стоять между границами слов, в 'partial' - где угодно.
+    Кавычки вокруг запроса при сравнении с текстом не учитываются, а запросы из одних
+    кавычек отбрасываются; если не осталось ни одного, матчер ничего не находит.
+    """
+
+    def __init__(self, queries, search_mode):
+        self.exact = search_mode == 'exact'
+        self.queries = {}
+        for query in queries:
+            pattern = fold_text(query.strip().strip('"«»').strip())
+            if pattern:
+                self.queries.setdefault(pattern, []).append(query)
+
+        body = build_trie_pattern(self.queries)
+        if self.exact:
+            body = rf'(?<!\w)({body})(?!\w)'
+        else:
+            body = f'({body})'
+        # Опережающая проверка находит совпадения, начинающиеся в каждой позиции, даже перекрывающиеся
+        self.regex = re.compile(f'(?={body})')
+        self.word_char = re.compile(r'\w')
+
+        # Запросы, которые являются началом более длинного, на той же позиции проверяются отдельно
+        self.prefixes = {
+            pattern: [other for other in self.queries if other != pattern and pattern.startswith(other)]
+            for pattern in self.queries
+        }
+
+    def match(self, text):
+        # Пустое выражение совпало бы с любым текстом, а в prefixes для него нет ключа
+        if not self.queries:
+            return []
+        folded = fold_text(text)
+        found = set()
+        for match in self.regex.finditer(folded):
+            pattern = match.group(1)
+            found.add(pattern)
+            for prefix in self.prefixes[pattern]:
+                if not self.exact or not self.word_char.match(folded, match.start() + len(prefix)):
+                    found.add(prefix)
+            if len(found) == len(self.queries):
+                break
+        return [query for pattern in found for query in self.queries[pattern]]
+
+def filter_items(items, matcher):
+    posts = []
+    for item in items:
+        matched = matcher.match(item.get('text', ''))
+        if matched:
+            item['matched_query'] = matched
+            posts.append(item)
+    return posts
+
+def search_windows(units, scheduler, cursors=None):
+    """Ищет посты для списка (query, start_time, end_time) одним пакетом execute.
+
+    cursors - значения next_from для продолжения выдачи (None - первая страница).
+    Для окон, запрос по которым не удался, в ответах стоит None.
+    """
+    calls = []
+    for index, (query, start_time, end_time) in enumerate(units):
+        params = {
+            'q': query,
+            'count': NEWSFEED_PAGE_SIZE,
+            'start_time': start_time,
+            'end_time': end_time,
+        }
+        if cursors and cursors[index]:
+            params['start_from'] = cursors[index]
+        calls.append(('newsfeed.search', params))
+
+    try:
+        return call_vk_api_batch(calls, scheduler)
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении запроса: {e}")
+        return [None] * len(units)
+
+def iter_newsfeed(units, scheduler, max_pages=NEWSFEED_MAX_PAGES):
+    """Генератор (unit, response) по страницам newsfeed.search с переходом по next_from.
+
+    response=None - страница не получена, дальше такое окно не листается.
+    """
+    cursors = [None] * len(units)
+    for page in range(max_pages):
+        responses = search_windows(units, scheduler, cursors)
+        next_units, next_cursors = [], []
+        for unit, response in zip(units, responses):
+            yield unit, response
+            if response and response.get('next_from') and response.get('items'):
+                next_units.append(unit)
+                next_cursors.append(response['next_from'])
+        if not next_units:
+            break
+        units, cursors = next_units, next_cursors
+
+def search_units(units, scheduler, matcher, search_pages=NEWSFEED_MAX_PAGES):
+    """Возвращает (посты, окна, поиск по которым не удался хотя бы на одной странице)."""
+    posts, failed_units = [], []
+    for unit, response in iter_newsfeed(units, scheduler, search_pages):
+        if response is None:
+            failed_units.append(unit)
+            continue
+        posts.extend(filter_items(response.get('items', []), matcher))
+    return posts, failed_units
+
+def store_comments(results, checkpoint, posts, comments, failed_posts):
+    """Пишет собранные комментарии; к неудавшимся постам можно снова взяться через claim_comments."""
+    results.add_comments(comments)
+    failed_keys = {DedupIndex.post_key(post) for post in failed_posts}
+    done_posts = [post for post in posts if DedupIndex.post_key(post) not in failed_keys]
+    if checkpoint:
+        checkpoint.save_comments(done_posts, comments)
+    results.index.mark_collected(DedupIndex.post_key(post) for post in done_posts)
+    results.index.release_comments(failed_posts)
+
+def count_attempt(attempts, key):
+    """Отмечает неудачу единицы работы; True - её ещё можно повторить в этом запуске."""
+    attempts[key] += 1
+    return attempts[key] < UNIT_RETRIES
+
+def read_remaining_pages(unit, response, scheduler, max_pages=NEWSFEED_MAX_PAGES):
+    """Посты окна со всех страниц выдачи (первая уже получена в response) или None, если страница не получена."""
+    items = list(response.get('items', []))
+    cursor = response.get('next_from')
+    for page in range(1, max_pages):
+        if not cursor:
+            break
+        page_response = search_windows([unit], scheduler, [cursor])[0]
+        if page_response is None:
+            return None
+        items.extend(page_response.get('items', []))
+        cursor = page_response.get('next_from') if page_response.get('items') else None
+    if cursor:
+        logger.warning(f"Окно {unit} переполнено и после {max_pages} страниц: часть постов не получена")
+    return items
+
+def is_window_saturated(response):
+    items = response.get('items', [])
+    return len(items) >= NEWSFEED_PAGE_SIZE or response.get('total_count', 0) > len(items)
+
+def format_window_tree(window_tree, initial_width):
+    lines = []
+    for query, nodes in window_tree.items():
+        splits = sum(1 for node in nodes if node[3] == 'split')
+        lines.append(f"🔎 {query}: запросов {len(nodes)}, делений {splits}")
+        for window_start, window_end, count, action in nodes[-ADAPTIVE_TREE_LINES:]:
+            # Глубина узла - сколько раз начальное окно делилось пополам
+            depth = max(round(math.log2(initial_width / (window_end - window_start))), 0)
+            marker = {'split': '✂️', 'merge': '🔗', 'ok': '✅'}[action]
+            lines.append(
+                f"{'    ' * (depth + 1)}{marker} "
+                f"{datetime.datetime.fromtimestamp(window_start).strftime('%d.%m %H:%M')} - "
+                f"{datetime.datetime.fromtimestamp(window_end).strftime('%d.%m %H:%M')} ({count})"
+            )
+    return "\n".join(lines)
+
+def get_adaptive_newsfeed(queries, start_datetime, end_datetime, scheduler, executor, results, include_comments, on_progress, matcher, time_step,
+                          search_pages=NEWSFEED_MAX_PAGES, comment_pages=COMMENTS_MAX_PAGES, expand_threads=False, checkpoint=None,
+                          query_starts=None):
+    """Проходит период окнами переменной ширины отдельно для каждого запроса.
+
+    Переполненное окно (200 постов или total_count больше полученного) делится пополам,
+    а после редкого окна следующее окно берётся вдвое шире. Переполненное окно минимальной
+    ширины дочитывается по next_from до search_pages страниц. Неудавшееся окно повторяется
+    той же ширины; после UNIT_RETRIES неудач подряд запрос останавливается.
+    query_starts - {запрос: datetime} для запросов, которые начинаются позже start_datetime.
+    Возвращает (незавершённые окна, посты без собранных комментариев).
+    """
+    range_starts = {query: get_unixtime_from_datetime((query_starts or {}).get(query, start_datetime)) for query in queries}
+    range_end = get_unixtime_from_datetime(end_datetime)
+    initial_width = time_step * 3600
+    cursors = {query: checkpoint.query_cursor(query, range_starts[query]) if checkpoint else range_starts[query] for query in queries}
+    widths = {query: initial_width for query in queries}
+    window_tree = {query: [] for query in queries}
+    search_failures = Counter()
+    comment_attempts = Counter()
+    unfinished_posts = []
+
+    start_time = time.time()
+    eta_estimator = EtaEstimator()
+
+    comment_retry = []
+    if checkpoint and include_comments:
+        comment_retry = results.index.claim_comments(checkpoint.pending_comment_posts())
+
+    while True:
+        units = [
+            (query, cursor, min(cursor + widths[query], range_end))
+            for query, cursor in cursors.items() if cursor < range_end and search_failures[query] < UNIT_RETRIES
+        ]
+        if not units and not comment_retry:
+            break
+
+        futures = {}
+        for batch_start in range(0, len(units), EXECUTE_BATCH_SIZE):
+            batch = units[batch_start:batch_start + EXECUTE_BATCH_SIZE]
+            futures[executor.submit(search_windows, batch, scheduler)] = batch
+
+        comment_futures = {}
+        if comment_retry:
+            comment_futures[executor.submit(get_comments, comment_retry, scheduler, comment_pages, expand_threads)] = comment_retry
+            comment_retry = []
+        for future in as_completed(futures):
+            for (query, window_start, window_end), response in zip(futures[future], future.result()):
+                if response is None:
+                    # Курсор и ширина не меняются: то же окно запрашивается в следующем круге
+                    search_failures[query] += 1
+                    continue
+                search_failures[query] = 0
+                items = response.get('items', [])
+                width = window_end - window_start
+
+                if is_window_saturated(response) and width > ADAPTIVE_MIN_WINDOW:
+                    widths[query] = max(width // 2, ADAPTIVE_MIN_WINDOW)
+                    window_tree[query].append((window_start, window_end, len(items), 'split'))
+                    continue
+                if is_window_saturated(response) and response.get('next_from'):
+                    # Делить окно дальше нельзя, поэтому остальные посты читаются страницами
+                    items = read_remaining_pages((query, window_start, window_end), response, scheduler, search_pages)
+                    if items is None:
+                        search_failures[query] += 1
+                        continue
+
+                posts = filter_items(items, matcher)
+                new_posts = results.add_posts(posts)
+                if checkpoint:
+                    checkpoint.save_search([(query, window_start, window_end)], posts)
+                comment_posts = results.index.claim_comments(new_posts) if include_comments else []
+                if comment_posts:
+                    comment_futures[executor.submit(get_comments, comment_posts, scheduler, comment_pages, expand_threads)] = comment_posts
+
+                cursors[query] = window_end
+                if len(items) < ADAPTIVE_SPARSE_ITEMS:
+                    widths[query] = min(width * 2, ADAPTIVE_MAX_WINDOW)
+                    window_tree[query].append((window_start, window_end, len(items), 'merge'))
+                else:
+                    window_tree[query].append((window_start, window_end, len(items), 'ok'))
+
+        for future in as_completed(comment_futures):
+            comments, failed_posts = future.result()
+            store_comments(results, checkpoint, comment_futures[future], comments, failed_posts)
+            for post in failed_posts:
+                if count_attempt(comment_attempts, DedupIndex.post_key(post)):
+                    comment_retry.extend(results.index.claim_comments([post]))
+                else:
+                    unfinished_posts.append(post)
+
+        covered = sum(cursor - range_starts[query] for query, cursor in cursors.items())
+        total_range = sum(range_end - range_start for range_start in range_starts.values())
+        progress = min(covered / total_range, 1.0) if total_range else 1.0
+        elapsed_time = time.time() - start_time
+        # Единица работы здесь - секунда пройденного периода
+        eta = eta_estimator.update(covered, total_range)
+
+        on_progress(
+            progress,
+            f"⏳ Прогресс: {progress:.2%} | ⌛ Прошло времени: {elapsed_time:.1f} сек\n"
+            f"📊 Найдено постов: {results.post_count} | 💬 Комментариев: {results.comment_count}\n"
+            f"⏱️ Осталось примерно: {format_eta(eta)}\n"
+            f"{format_window_tree(window_tree, initial_width)}"
+        )
+
+    unfinished_units = [(query, cursor, range_end) for query, cursor in cursors.items() if cursor < range_end]
+    return unfinished_units, unfinished_posts
+
+
+class CheckpointStore:
+    """SQLite-файл с завершёнными единицами работы (query, окно) и их результатами.
+
+    Записи делаются по мере готовности, поэтому прерванный парсинг можно продолжить,
+    пропустив уже обработанные окна и посты с собранными комментариями.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS units (
+                query TEXT, start_time INTEGER, end_time INTEGER,
+                PRIMARY KEY (query, start_time, end_time)
+            );
+            CREATE TABLE IF NOT EXISTS posts (
+                owner_id INTEGER, post_id INTEGER, data TEXT, comments_done INTEGER DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS posts_key ON posts (owner_id, post_id);
+            CREATE TABLE IF NOT EXISTS comments (post_owner_id INTEGER, post_id INTEGER, data TEXT);
+        """)
+
+    @staticmethod
+    def job_path(*job_params):
+        job_id = hashlib.sha1(json.dumps(job_params, default=str, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        return os.path.join(CHECKPOINT_DIR, f"{job_id}.sqlite")
+
+    def done_units(self):
+        with self.lock:
+            return set(self.conn.execute("SELECT query, start_time, end_time FROM units"))
+
+    def query_cursor(self, query, range_start):
+        # Адаптивный режим идёт по периоду подряд, поэтому достаточно конца последнего окна
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(end_time) FROM units WHERE query = ?", (query,)).fetchone()
+        return max(row[0] or range_start, range_start)
+
+    def save_search(self, units, posts):
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO units VALUES (?, ?, ?)", units)
+            self.conn.executemany(
+                "INSERT INTO posts (owner_id, post_id, data) VALUES (?, ?, ?)",
+                [(post['owner_id'], post['id'], json.dumps(post, ensure_ascii=False)) for post in posts]
+            )
+
+    def save_comments(self, posts, comments):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO comments VALUES (?, ?, ?)",
+                [(comment['post_owner_id'], comment['post_id'], json.dumps(comment, ensure_ascii=False)) for comment in comments]
+            )
+            self.conn.executemany(
+                "UPDATE posts SET comments_done = 1 WHERE owner_id = ? AND post_id = ?",
+                [(post['owner_id'], post['id']) for post in posts]
+            )
+
+    def pending_comment_posts(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT data FROM posts WHERE comments_done = 0").fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def commented_keys(self):
+        with self.lock:
+            return set(self.conn.execute("SELECT DISTINCT owner_id, post_id FROM posts WHERE comments_done = 1"))
+
+    def iter_chunks(self, table):
+        cursor = self.conn.execute(f"SELECT data FROM {table} ORDER BY rowid")
+        while True:
+            rows = cursor.fetchmany(RESULT_CHUNK_SIZE)
+            if not rows:
+                break
+            yield [json.loads(data) for data, in rows]
+
+    def iter_post_chunks(self):
+        return self.iter_chunks('posts')
+
+    def iter_comment_chunks(self):
+        return self.iter_chunks('comments')
+
+    def close(self):
+        self.conn.close()
+
+def flatten_post(post):
+    row = {column: post.get(column) for column in POST_COLUMNS}
+    for counter in ENGAGEMENT_COUNTERS:
+        row[f'{counter}_count'] = (post.get(counter) or {}).get('count', 0)
+    row['attachments'] = json.dumps(post.get('attachments', []), ensure_ascii=False)
+    # Всё, что не разложено по колонкам, сохраняется одной JSON-строкой
+    extra = {key: value for key, value in post.items() if key not in POST_SCHEMA.names and key not in ENGAGEMENT_COUNTERS}
+    row['extra'] = json.dumps(extra, ensure_ascii=False)
+    return row
+
+def flatten_comment(comment):
+    row = {column: comment.get(column) for column in COMMENT_COLUMNS}
+    row['likes_count'] = (comment.get('likes') or {}).get('count', 0)
+    row['parents_stack'] = json.dumps(comment.get('parents_stack', []))
+    row['attachments'] = json.dumps(comment.get('attachments', []), ensure_ascii=False)
+    return row
+
+class ParquetChunkWriter:
+    """Пишет строки в Parquet группами по chunk_size, не держа весь результат в памяти."""
+
+    def __init__(self, path, schema, flatten, chunk_size=RESULT_CHUNK_SIZE):
+        self.path = path
+        self.schema = schema
+        self.flatten = flatten
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.count = 0
+        self.writer = pq.ParquetWriter(path, schema)
+
+    def write(self, items):
+        for item in items:
+            self.rows.append(self.flatten(item))
+            self.count += 1
+            if len(self.rows) >= self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+class DedupIndex:
+    """Общий для всех потоков индекс постов по (owner_id, post_id).
+
+    Запоминает, какими запросами найден каждый пост, к каким постам комментарии
+    уже взяты в работу (commented) и к каким действительно собраны (collected).
+    В файл сохраняются только собранные, чтобы не скачивать их повторно в следующих
+    запусках. Посты из known (найденные прошлыми запусками инкрементального режима)
+    новыми не считаются.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.queries = {}
+        self.commented = set()
+        self.collected = set()
+        self.known = set()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as index_file:
+                self.collected = {tuple(key) for key in json.load(index_file)}
+            self.commented = set(self.collected)
+
+    @staticmethod
+    def post_key(post):
+        return post['owner_id'], post['id']
+
+    def add_post(self, post):
+        """Отмечает совпадения поста с запросами; True - пост встретился впервые."""
+        with self.lock:
+            if self.post_key(post) in self.known:
+                return False
+            matched = self.queries.setdefault(self.post_key(post), [])
+            is_new = not matched
+            for query in post.get('matched_query', []):
+                if query not in matched:
+                    matched.append(query)
+            return is_new
+
+    def claim_comments(self, posts):
+        """Оставляет только посты, комментарии к которым ещё никто не собирал."""
+        claimed = []
+        with self.lock:
+            for post in posts:
+                key = self.post_key(post)
+                if key not in self.commented:
+                    self.commented.add(key)
+                    claimed.append(post)
+        return claimed
+
+    def mark_collected(self, keys):
+        """Отмечает посты (owner_id, post_id), комментарии к которым записаны в результат."""
+        keys = set(keys)
+        with self.lock:
+            self.commented.update(keys)
+            self.collected.update(keys)
+
+    def release_comments(self, posts):
+        """Возвращает посты, комментарии к которым собрать не удалось: их можно взять снова."""
+        with self.lock:
+            self.commented.difference_update(self.post_key(post) for post in posts)
+
+    def save(self):
+        if self.path:
+            with self.lock, open(self.path, 'w', encoding='utf-8') as index_file:
+                json.dump(sorted(self.collected), index_file)
+
+class ResultWriter:
+    """Посты и комментарии парсинга в виде двух Parquet-файлов в каталоге запуска.
+
+    Каждый пост пишется один раз; повторные совпадения только дополняют список
+    matched_query в индексе, и он добавляется колонкой при закрытии.
+    """
+
+    def __init__(self, directory, index=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.index = index or DedupIndex()
+        self.posts_path = os.path.join(directory, 'posts.parquet')
+        self.partial_posts_path = os.path.join(directory, 'posts.partial.parquet')
+        self.comments_path = os.path.join(directory, 'comments.parquet')
+        self.lock = threading.Lock()
+        self.posts = ParquetChunkWriter(self.partial_posts_path, PARTIAL_POST_SCHEMA, flatten_post)
+        self.comments = ParquetChunkWriter(self.comments_path, COMMENT_SCHEMA, flatten_comment)
+        # Заполняются run_scrape: работа, которую не удалось завершить за запуск
+        self.unfinished_units = []
+        self.unfinished_posts = []
+
+    @staticmethod
+    def new_run_dir():
+        return os.path.join(RESULTS_DIR, datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f'))
+
+    @property
+    def post_count(self):
+        return self.posts.count
+
+    @property
+    def comment_count(self):
+        return self.comments.count
+
+    def add_posts(self, posts):
+        """Пишет впервые встреченные посты и возвращает их список."""
+        with self.lock:
+            new_posts = [post for post in posts if self.index.add_post(post)]
+            self.posts.write(new_posts)
+        return new_posts
+
+    def add_comments(self, comments):
+        with self.lock:
+            self.comments.write(comments)
+
+    def close(self):
+        self.posts.close()
+        self.comments.close()
+
+        # Дописываем списки запросов к постам, проходя файл по группам строк
+        with pq.ParquetWriter(self.posts_path, POST_SCHEMA) as writer:
+            for batch in pq.ParquetFile(self.partial_posts_path).iter_batches(batch_size=RESULT_CHUNK_SIZE):
+                keys = zip(batch.column('owner_id').to_pylist(), batch.column('id').to_pylist())
+                matched = pa.array([self.index.queries.get(key, []) for key in keys], pa.list_(pa.string()))
+                writer.write_table(pa.Table.from_batches([batch]).add_column(0, POST_SCHEMA.field('matched_query'), matched))
+        os.remove(self.partial_posts_path)
+
+    @property
+    def complete(self):
+        return not self.unfinished_units and not self.unfinished_posts
+
+    def read_frames(self):
+        return pd.read_parquet(self.posts_path), pd.read_parquet(self.comments_path)
+
+def export_csv(parquet_path, csv_path):
+    """Построчно (по группам Parquet) выгружает файл в CSV; .gz в имени включает сжатие."""
+    opener = gzip.open if csv_path.endswith('.gz') else open
+    with opener(csv_path, 'wt', encoding='utf-8', newline='') as csv_file:
+        header = True
+        for batch in pq.ParquetFile(parquet_path).iter_batches(batch_size=RESULT_CHUNK_SIZE):
+            frame = batch.to_pandas()
+            for field in batch.schema:
+                if pa.types.is_list(field.type):
+                    frame[field.name] = frame[field.name].map('; '.join)
+            frame.to_csv(csv_file, index=False, header=header)
+            header = False
+    return csv_path
+
+class MonitorState:
+    """SQLite-файл состояния инкрементального режима между запусками.
+
+    Для каждого запроса хранится отметка, до которой период уже просмотрен, а для
+    найденных постов - дата, число комментариев при последней проверке и id последнего
+    собранного комментария. Следующий запуск ищет только от отметки и дособирает
+    комментарии только к постам, у которых изменилось их число.
+    """
+
+    def __init__(self, path=MONITOR_STATE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS watermarks (query TEXT PRIMARY KEY, watermark INTEGER);
+            CREATE TABLE IF NOT EXISTS posts (
+                owner_id INTEGER, post_id INTEGER, date INTEGER, comments_count INTEGER, last_comment_id INTEGER,
+                PRIMARY KEY (owner_id, post_id)
+            );
+            CREATE INDEX IF NOT EXISTS posts_date ON posts (date);
+        """)
+
+    def query_starts(self, queries, start_datetime):
+        """{запрос: datetime начала поиска}; запросы без отметки начинаются со start_datetime."""
+        with self.lock:
+            watermarks = dict(self.conn.execute("SELECT query, watermark FROM watermarks"))
+        return {
+            query: max(datetime.datetime.fromtimestamp(watermarks[query]), start_datetime) if query in watermarks else start_datetime
+            for query in queries
+        }
+
+    def known_keys(self, since):
+        with self.lock:
+            return set(self.conn.execute("SELECT owner_id, post_id FROM posts WHERE date >= ?", (since,)))
+
+    def watched_posts(self, since):
+        """{(owner_id, post_id): (comments_count, last_comment_id)} для постов не старше since."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT owner_id, post_id, comments_count, last_comment_id FROM posts WHERE date >= ?", (since,)
+            ).fetchall()
+        return {(owner_id, post_id): (comments_count, last_comment_id) for owner_id, post_id, comments_count, last_comment_id in rows}
+
+    def save_comment_counts(self, posts):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE posts SET comments_count = ? WHERE owner_id = ? AND post_id = ?",
+                [((post.get('comments') or {}).get('count', 0), post['owner_id'], post['id']) for post in posts]
+            )
+
+    def record_run(self, results, queries, end_datetime, include_comments):
+        """Переносит в состояние посты и комментарии закрытого ResultWriter и сдвигает отметки запросов."""
+        # Отметка не позже конца периода минус перекрытие и не позже последней увиденной даты:
+        # посты, которые поиск VK проиндексирует с задержкой, попадут в следующий запуск
+        range_end = get_unixtime_from_datetime(end_datetime)
+        latest_seen = {}
+        unfinished_keys = {DedupIndex.post_key(post) for post in results.unfinished_posts}
+
+        with self.lock, self.conn:
+            for batch in pq.ParquetFile(results.posts_path).iter_batches(batch_size=RESULT_CHUNK_SIZE, columns=['matched_query', 'date', 'id', 'owner_id', 'comments_count']):
+                rows = batch.to_pylist()
+                for row in rows:
+                    for query in row['matched_query']:
+                        latest_seen[query] = max(latest_seen.get(query, row['date']), row['date'])
+                # Без собранных комментариев число не сохраняется, чтобы следующий запуск собрал их целиком
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO posts (owner_id, post_id, date, comments_count) VALUES (?, ?, ?, ?)",
+                    [
+                        (row['owner_id'], row['id'], row['date'],
+                         row['comments_count'] if include_comments and (row['owner_id'], row['id']) not in unfinished_keys else None)
+                        for row in rows
+                    ]
+                )
+
+            last_comment_ids = {}
+            for batch in pq.ParquetFile(results.comments_path).iter_batches(batch_size=RESULT_CHUNK_SIZE, columns=['post_owner_id', 'post_id', 'id']):
+                for row in batch.to_pylist():
+                    key = (row['post_owner_id'], row['post_id'])
+                    last_comment_ids[key] = max(last_comment_ids.get(key, row['id']), row['id'])
+            self.conn.executemany(
+                "UPDATE posts SET last_comment_id = MAX(IFNULL(last_comment_id, 0), ?) WHERE owner_id = ? AND post_id = ?",
+                [(comment_id, owner_id, post_id) for (owner_id, post_id), comment_id in last_comment_ids.items()]
+            )
+
+            watermarks = {query: min(latest_seen.get(query, range_end), range_end - MONITOR_OVERLAP) for query in queries}
+            # Окна, которые не удалось обработать, остаются за отметкой и повторяются следующим запуском
+            for query, window_start, _ in results.unfinished_units:
+                if query in watermarks:
+                    watermarks[query] = min(watermarks[query], window_start)
+            self.conn.executemany(
+                "INSERT INTO watermarks VALUES (?, ?) ON CONFLICT (query) DO UPDATE SET watermark = MAX(watermark, excluded.watermark)",
+                list(watermarks.items())
+            )
+
+    def close(self):
+        self.conn.close()
+
+def partition_key(*parts):
+    # Стабильный между процессами и машинами хеш (встроенный hash() зависит от PYTHONHASHSEED)
+    return int(hashlib.sha1("|".join(map(str, parts)).encode('utf-8')).hexdigest()[:15], 16)
+
+def in_shard(shard, *parts):
+    """shard - (номер, всего) или None; True, если единица работы относится к этому шарду."""
+    return shard is None or partition_key(*parts) % shard[1] == shard[0]
+
+def build_time_units(queries, start_datetime, end_datetime, time_step, shard=None, query_starts=None):
+    """Единицы работы (query, start_time, end_time) с шагом time_step часов.
+
+    query_starts - {запрос: datetime}: такие запросы нарезаются от своего начала.
+    Шард выбирается по началу окна: все запросы одного окна попадают в один шард, и пост,
+    совпавший с несколькими запросами, пишется и получает комментарии только там.
+    """
+    units = []
+    delta = datetime.timedelta(hours=time_step)
+    current_time = start_datetime
+    while current_time < end_datetime:
+        end_time = min(current_time + delta, end_datetime)
+        for query in queries:
+            if query_starts and query in query_starts:
+                continue
+            unit = (query, get_unixtime_from_datetime(current_time), get_unixtime_from_datetime(end_time))
+            if in_shard(shard, unit[1]):
+                units.append(unit)
+        current_time += delta
+    for query, query_start in (query_starts or {}).items():
+        if query in queries:
+            units.extend(build_time_units([query], query_start, end_datetime, time_step, shard))
+    return units
+
+def get_async_newsfeed(queries, start_datetime, end_datetime, engine, results, include_comments, on_progress, matcher, time_step,
+                       search_pages=NEWSFEED_MAX_PAGES, comment_pages=COMMENTS_MAX_PAGES, expand_threads=False, checkpoint=None,
+                       shard=None, query_starts=None):
+    """Фиксированный шаг через AsyncVKEngine: окна всех шагов отправляются разом порциями,
+    которых хватает, чтобы занять все concurrency слотов движка.
+
+    Неудавшиеся окна и посты повторяются следующим проходом, всего до UNIT_RETRIES проходов.
+    Возвращает (незавершённые окна, посты без собранных комментариев).
+    """
+    units = build_time_units(queries, start_datetime, end_datetime, time_step, shard, query_starts)
+    slice_size = engine.concurrency * EXECUTE_BATCH_SIZE
+
+    start_time = time.time()
+    eta_estimator = EtaEstimator()
+
+    comment_retry = []
+    if checkpoint:
+        done_units = checkpoint.done_units()
+        units = [unit for unit in units if unit not in done_units]
+        comment_retry = results.index.claim_comments(checkpoint.pending_comment_posts()) if include_comments else []
+    total_units = len(units)
+    units_done = 0
+
+    def collect_comments(posts):
+        comments, failed_posts = get_comments(posts, engine, comment_pages, expand_threads)
+        store_comments(results, checkpoint, posts, comments, failed_posts)
+        return failed_posts
+
+    for attempt in range(UNIT_RETRIES):
+        if comment_retry:
+            comment_retry = results.index.claim_comments(collect_comments(comment_retry))
+
+        failed_units = []
+        for slice_start in range(0, len(units), slice_size):
+            slice_units = units[slice_start:slice_start + slice_size]
+            posts, slice_failed = search_units(slice_units, engine, matcher, search_pages)
+            new_posts = results.add_posts(posts)
+            if checkpoint:
+                checkpoint.save_search([unit for unit in slice_units if unit not in slice_failed], posts)
+            failed_units.extend(slice_failed)
+            units_done += len(slice_units) - len(slice_failed)
+
+            # Комментарии собираются пакетами для всех новых постов порции
+            comment_posts = results.index.claim_comments(new_posts) if include_comments else []
+            if comment_posts:
+                comment_retry.extend(results.index.claim_comments(collect_comments(comment_posts)))
+
+            progress = units_done / total_units if total_units else 1.0
+            elapsed_time = time.time() - start_time
+            eta = eta_estimator.update(units_done, total_units)
+
+            on_progress(
+                progress,
+                f"⏳ Прогресс: {progress:.2%} | ⌛ Прошло времени: {elapsed_time:.1f} сек\n"
+                f"📊 Найдено постов: {results.post_count} | 💬 Комментариев: {results.comment_count}\n"
+                f"🕒 Окон обработано: {units_done} из {total_units} | ⏱️ Осталось примерно: {format_eta(eta)}"
+            )
+
+        units = failed_units
+        if not units and not comment_retry:
+            break
+
+    # Посты, взятые в работу на последнем проходе, возвращаются в индекс незавершёнными
+    results.index.release_comments(comment_retry)
+    return units, comment_retry
+
+def get_pipeline_newsfeed(queries, start_datetime, end_datetime, scheduler, max_workers, results, include_comments, on_progress, matcher, time_step,
+                          search_pages=NEWSFEED_MAX_PAGES, comment_pages=COMMENTS_MAX_PAGES, expand_threads=False, checkpoint=None,
+                          shard=None, query_starts=None):
+    """Фиксированный шаг на пуле потоков.
+
+    Неудавшиеся окна и посты ставятся в очередь снова, каждый не больше UNIT_RETRIES раз.
+    Возвращает (незавершённые окна, посты без собранных комментариев).
+    """
+    start_time = time.time()
+    eta_estimator = EtaEstimator()
+
+    # Двухэтапный конвейер: пакеты поиска по всем окнам сразу отдают найденные посты
+    # в очередь комментариев, а пул потоков всё время занят задачами обоих этапов
+    units = build_time_units(queries, start_datetime, end_datetime, time_step, shard, query_starts)
+    search_batches = deque(units[i:i + EXECUTE_BATCH_SIZE] for i in range(0, len(units), EXECUTE_BATCH_SIZE))
+    comment_queue = deque()
+    if checkpoint:
+        # Продолжение: пропускаем готовые окна и дозапрашиваем комментарии к уже найденным постам
+        done_units = checkpoint.done_units()
+        units = [unit for unit in units if unit not in done_units]
+        search_batches = deque(units[i:i + EXECUTE_BATCH_SIZE] for i in range(0, len(units), EXECUTE_BATCH_SIZE))
+        if include_comments:
+            comment_queue.extend(results.index.claim_comments(checkpoint.pending_comment_posts()))
+    total_searches = len(search_batches)
+    in_flight = {}
+    searches_done = 0
+    comment_batches_done = 0
+    comment_batches_submitted = 0
+    search_attempts = Counter()
+    comment_attempts = Counter()
+    unfinished_units = []
+    unfinished_posts = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while search_batches or in_flight or comment_queue:
+            searching = bool(search_batches) or any(kind == 'search' for kind, _ in in_flight.values())
+
+            # Комментарии в приоритете: неполный пакет ждёт, пока идёт поиск
+            while comment_queue and (len(comment_queue) >= EXECUTE_BATCH_SIZE or not searching):
+                batch = [comment_queue.popleft() for _ in range(min(EXECUTE_BATCH_SIZE, len(comment_queue)))]
+                in_flight[executor.submit(get_comments, batch, scheduler, comment_pages, expand_threads)] = ('comments', batch)
+                comment_batches_submitted += 1
+
+            while search_batches and len(in_flight) < max_workers * 2:
+                batch = search_batches.popleft()
+                in_flight[executor.submit(search_units, batch, scheduler, matcher, search_pages)] = ('search', batch)
+
+            if not in_flight:
+                continue
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, batch = in_flight.pop(future)
+                if kind == 'search':
+                    posts, failed_units = future.result()
+                    new_posts = results.add_posts(posts)
+                    if checkpoint:
+                        checkpoint.save_search([unit for unit in batch if unit not in failed_units], posts)
+                    if include_comments:
+                        comment_queue.extend(results.index.claim_comments(new_posts))
+                    searches_done += 1
+                    retry_units = []
+                    for unit in failed_units:
+                        (retry_units if count_attempt(search_attempts, unit) else unfinished_units).append(unit)
+                    if retry_units:
+                        search_batches.append(retry_units)
+                        total_searches += 1
+                else:
+                    comments, failed_posts = future.result()
+                    store_comments(results, checkpoint, batch, comments, failed_posts)
+                    comment_batches_done += 1
+                    for post in failed_posts:
+                        if count_attempt(comment_attempts, DedupIndex.post_key(post)):
+                            comment_queue.extend(results.index.claim_comments([post]))
+                        else:
+                            unfinished_posts.append(post)
+
+            # Оставшиеся пакеты комментариев заранее неизвестны, поэтому оцениваем их по очереди
+            pending_comment_batches = math.ceil(len(comment_queue) / EXECUTE_BATCH_SIZE)
+            total_tasks = total_searches + comment_batches_submitted + pending_comment_batches
+            progress = (searches_done + comment_batches_done) / total_tasks if total_tasks else 1.0
+
+            elapsed_time = time.time() - start_time
+            eta = eta_estimator.update(searches_done + comment_batches_done, total_tasks)
+
+            on_progress(
+                progress,
+                f"⏳ Прогресс: {progress:.2%} | ⌛ Прошло времени: {elapsed_time:.1f} сек\n"
+                f"📊 Найдено постов: {results.post_count} | 💬 Комментариев: {results.comment_count}\n"
+                f"🔍 Пакетов поиска: {searches_done} из {total_searches} | "
+                f"💬 Пакетов комментариев: {comment_batches_done} из {comment_batches_submitted + pending_comment_batches} | "
+                f"⏱️ Осталось примерно: {format_eta(eta)}"
+            )
+
+    return unfinished_units, unfinished_posts
+
+def run_scrape(queries, start_datetime, end_datetime, access_tokens, include_comments, on_progress, search_mode, time_step, token_stats=None, adaptive=False,
+               search_pages=NEWSFEED_MAX_PAGES, comment_pages=COMMENTS_MAX_PAGES, expand_threads=False,
+               engine='threads', concurrency=ASYNC_CONCURRENCY, checkpoint=None, results_dir=None, dedup_index=None,
+               token_cache=None, shard=None, monitor=None, response_cache=None, metrics=None):
+    """Собирает посты и комментарии в Parquet-файлы и возвращает закрытый ResultWriter.
+
+    on_progress(доля, текст) вызывается после каждой завершённой порции работы.
+    shard=(номер, всего) оставляет только единицы работы этого шарда: окна со всеми запросами
+    при фиксированном шаге и запросы целиком в адаптивном и инкрементальном режимах.
+    monitor - MonitorState инкрементального режима: каждый запрос ищется от своей отметки
+    прошлого запуска, в результат попадают только новые посты и новые комментарии.
+    Окна и посты, запросы по которым так и не удались, не отмечаются в контрольной точке
+    выполненными и перечислены в unfinished_units и unfinished_posts результата.
+    response_cache - ResponseCache для ответов поиска и комментариев.
+    metrics - ApiMetrics, в которые пишутся задержки, ошибки и повторы всех запросов.
+    """
+    # Результаты сразу пишутся на диск; с контрольной точкой туда же попадают прошлые запуски задания
+    results = ResultWriter(results_dir or ResultWriter.new_run_dir(), dedup_index)
+    if checkpoint:
+        for posts in checkpoint.iter_post_chunks():
+            results.add_posts(posts)
+        for comments in checkpoint.iter_comment_chunks():
+            results.add_comments(comments)
+        results.index.mark_collected(checkpoint.commented_keys())
+
+    # Паузы между шагами больше не нужны: темп задаёт планировщик токенов,
+    # а число потоков растёт вместе с количеством токенов
+    scheduler = TokenScheduler(access_tokens, token_stats, cache=token_cache, response_cache=response_cache, metrics=metrics)
+    max_workers = max(10, len(access_tokens) * TOKEN_RATE_LIMIT)
+    # Все запросы компилируются один раз и проверяются по каждому посту за один проход
+    matcher = QueryMatcher(queries, search_mode)
+    # Окна адаптивного режима заранее неизвестны, поэтому он делится между шардами по запросам
+    adaptive_queries = [query for query in queries if in_shard(shard, query)]
+
+    query_starts = None
+    if monitor:
+        # Окна инкрементального режима зависят от отметок, поэтому шарды тоже делятся по запросам
+        queries, shard = adaptive_queries, None
+        query_starts = monitor.query_starts(queries, start_datetime)
+        # Посты прошлых запусков из перекрытия окон повторно не пишутся, их комментарии обновляются ниже
+        results.index.known.update(monitor.known_keys(get_unixtime_from_datetime(min(query_starts.values(), default=start_datetime))))
+        if include_comments:
+            on_progress(0.0, "💬 Проверка новых комментариев к постам прошлых запусков...")
+            refresh_comments(monitor, scheduler, results, comment_pages, expand_threads)
+
+    if engine == 'async':
+        with AsyncVKEngine(scheduler, concurrency) as async_engine:
+            if adaptive:
+                # Потоки адаптивного режима только ждут ответов, запросы идут через общий пул движка
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    unfinished = get_adaptive_newsfeed(
+                        adaptive_queries, start_datetime, end_datetime, async_engine, executor, results,
+                        include_comments, on_progress, matcher, time_step,
+                        search_pages, comment_pages, expand_threads, checkpoint, query_starts
+                    )
+            else:
+                unfinished = get_async_newsfeed(
+                    queries, start_datetime, end_datetime, async_engine, results,
+                    include_comments, on_progress, matcher, time_step,
+                    search_pages, comment_pages, expand_threads, checkpoint, shard, query_starts
+                )
+    elif adaptive:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            unfinished = get_adaptive_newsfeed(
+                adaptive_queries, start_datetime, end_datetime, scheduler, executor, results,
+                include_comments, on_progress, matcher, time_step,
+                search_pages, comment_pages, expand_threads, checkpoint, query_starts
+            )
+    else:
+        unfinished = get_pipeline_newsfeed(
+            queries, start_datetime, end_datetime, scheduler, max_workers, results,
+            include_comments, on_progress, matcher, time_step,
+            search_pages, comment_pages, expand_threads, checkpoint, shard, query_starts
+        )
+
+    results.unfinished_units, results.unfinished_posts = unfinished
+    if not results.complete:
+        logger.warning(f"Не завершено окон: {len(results.unfinished_units)}, постов без комментариев: {len(results.unfinished_posts)}")
+    results.close()
+    if monitor:
+        monitor.record_run(results, queries, end_datetime, include_comments)
+    return results
+
+def get_vk_newsfeed(*args, **kwargs):
+    """То же, что run_scrape, но возвращает (posts_df, comments_df) для показа в интерфейсе."""
+    return run_scrape(*args, **kwargs).read_frames()
+
+def check_token(token):
+    """Статус токена по запросу users.get или None, если VK не ответил или вернул временную ошибку."""
+    try:
+        result = http_session.get(
+            f"{VK_API_URL}/users.get",
+            params={'access_token': token, 'v': VK_API_VERSION},
+            timeout=TOKEN_VALIDATION_TIMEOUT
+        ).json()
+    except (requests.RequestException, ValueError):
+        return None
+
+    if 'response' in result:
+        return 'valid'
+    error_code = result.get('error', {}).get('error_code')
+    if error_code in RATE_LIMIT_BACKOFF:
+        return 'rate_limited'
+    if error_code in TOKEN_FATAL_ERRORS:
+        return 'revoked'
+    # Прочие ошибки (например, 10 - внутренняя ошибка VK) не говорят о самом токене и не кэшируются
+    return None
+
+def validate_tokens(tokens, cache=None):
+    tokens = [token.strip() for token in tokens if token.strip()]
+    statuses = {}
+
+    # Свежие статусы из кэша не перепроверяются, остальные токены проверяются параллельно
+    for token in tokens:
+        if cache and cache.get(token):
+            statuses[token] = cache.get(token)
+
+    unchecked = [token for token in tokens if token not in statuses]
+    if unchecked:
+        with ThreadPoolExecutor(max_workers=min(TOKEN_VALIDATION_WORKERS, len(unchecked))) as executor:
+            for token, status in zip(unchecked, executor.map(check_token, unchecked)):
+                statuses[token] = status
+                if cache and status:
+                    cache.set(token, status)
+
+    # Токен с превышенным лимитом рабочий: планировщик сам выдержит паузу
+    valid_tokens = [token for token in tokens if statuses[token] in ('valid', 'rate_limited')]
+    invalid_tokens = [token for token in tokens if statuses[token] not in ('valid', 'rate_limited')]
+
+    return valid_tokens, invalid_tokens